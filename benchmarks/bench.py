@@ -0,0 +1,268 @@
+"""
+Benchmarks the pixelsort pipeline stage by stage on generated images, offline and on the CPU only.
+
+Every stage is timed for each image size, super pixel size and angle: rotation into a SuperPixelImage, every interval
+function, every sorting function's keys, sort_image for every interval/sorting pair, _place_blocks and a whole
+pixelsort() run. Times are the best of --repeat runs; peak memory is the largest traced allocation during one more
+run (NumPy allocations are traced, Pillow's internal image buffers are not).
+
+    python benchmarks/bench.py --output results.json
+    python benchmarks/bench.py --quick --baseline results.json
+"""
+
+import argparse
+import copy
+import json
+import math
+import os
+import platform
+import sys
+import time
+import tracemalloc
+import typing
+
+import numpy as np
+import PIL
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pixelsort.interval import interval_choices  # noqa: E402
+from pixelsort.main import SortSetup, _place_blocks, sort_frame  # noqa: E402
+from pixelsort.sorting import sort_image, sorting_choices  # noqa: E402
+
+SIZES = [0.25, 1, 4, 12, 50]
+SUPER_PIXEL_SIZES = [1, 4]
+ANGLES = [0, 90, 30]
+
+
+def synthetic_image(megapixels: float, seed: int = 0) -> Image.Image:
+    """A 3:2 RGB image of about the given size with smooth gradients, hard edges and noise, so every interval
+    function finds a realistic number of intervals."""
+    width = int(math.sqrt(megapixels * 1e6 * 1.5))
+    height = int(megapixels * 1e6 / width)
+    rng = np.random.default_rng(seed)
+    y, x = np.ogrid[0:height, 0:width]
+    image = np.empty((height, width, 3), dtype=np.float32)
+    image[..., 0] = 255 * x / width
+    image[..., 1] = 255 * y / height
+    image[..., 2] = 128 + 127 * np.sin(x / 37.0) * np.cos(y / 23.0)
+    blocks = rng.integers(0, 2, (height // 64 + 1, width // 64 + 1), dtype=np.uint8)
+    image *= 0.5 + 0.5 * np.kron(blocks, np.ones((64, 64)))[:height, :width, None]
+    image += rng.normal(0, 12, image.shape)
+    return Image.fromarray(np.clip(image, 0, 255).astype(np.uint8))
+
+
+def stripes(size: typing.Tuple[int, int]) -> Image.Image:
+    """Black and white diagonal stripes for the file based interval functions."""
+    width, height = size
+    y, x = np.ogrid[0:height, 0:width]
+    return Image.fromarray(((x + 2 * y) // 40 % 2 * 255).astype(np.uint8))
+
+
+def measure(function: typing.Callable[[], object], repeat: int, memory: bool) -> dict:
+    seconds = math.inf
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        seconds = min(seconds, time.perf_counter() - start)
+    result = {"seconds": seconds}
+    if memory:
+        tracemalloc.start()
+        function()
+        result["peak_bytes"] = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return result
+
+
+def run(args: argparse.Namespace) -> dict:
+    results = {}
+
+    def record(name: str, function: typing.Callable[[], object]):
+        results[name] = measure(function, args.repeat, not args.no_memory)
+        print(f"{name:<70} {results[name]['seconds']:9.4f}s", flush=True)
+
+    for megapixels in args.sizes:
+        image = synthetic_image(megapixels)
+        interval_image = stripes(image.size)
+        for super_pixel_size in args.super_pixel_sizes:
+            for angle in args.angles:
+                prefix = f"{megapixels}MP/p{super_pixel_size}/a{angle:g}"
+                setup = SortSetup(
+                    image.size,
+                    interval_image=interval_image,
+                    angle=angle,
+                    super_pixel_size=super_pixel_size,
+                    # Fixed intervals for the random and waves interval functions
+                    seed=0,
+                )
+                record(f"{prefix}/prepare", lambda: setup.prepare(image))
+                super_pixel_image = setup.prepare(image)
+                mask_data = setup.mask_data()
+
+                intervals = {}
+                for name in args.intervals:
+                    interval_setup = setup.with_intervals(name)
+
+                    def determine_intervals():
+                        # Time the interval function itself, not cached levels.
+                        uncached = copy.copy(super_pixel_image)
+                        uncached._keys = {}
+                        return interval_setup.intervals(uncached)
+
+                    record(f"{prefix}/intervals/{name}", determine_intervals)
+                    intervals[name] = interval_setup.intervals(super_pixel_image)
+
+                for name in args.sorts:
+                    function = sorting_choices[name]
+                    record(
+                        f"{prefix}/keys/{name}",
+                        lambda: function(super_pixel_image.average_colors),
+                    )
+                    super_pixel_image.keys(function)
+
+                perm = None
+                for interval_name in args.intervals:
+                    for sort_name in args.sorts:
+
+                        def sort():
+                            return sort_image(
+                                super_pixel_image.size,
+                                super_pixel_image,
+                                mask_data,
+                                intervals[interval_name],
+                                0,
+                                sorting_choices[sort_name],
+                            )
+
+                        record(f"{prefix}/sort_image/{interval_name}/{sort_name}", sort)
+                        perm = sort()
+
+                if perm is not None:
+                    record(
+                        f"{prefix}/place_blocks",
+                        lambda: _place_blocks(perm, super_pixel_image),
+                    )
+                record(f"{prefix}/pixelsort", lambda: sort_frame(image, setup))
+    return results
+
+
+def compare(results: dict, baseline: dict, tolerance: float, min_seconds: float) -> int:
+    """Prints every measurement that got slower or larger than the baseline by more than tolerance and returns how
+    many there were."""
+    regressions = 0
+    for name, result in results.items():
+        before = baseline.get(name)
+        if before is None:
+            continue
+        slower = result["seconds"] > before["seconds"] * (1 + tolerance) and (
+            result["seconds"] - before["seconds"] > min_seconds
+        )
+        larger = "peak_bytes" in result and "peak_bytes" in before
+        larger = larger and result["peak_bytes"] > before["peak_bytes"] * (
+            1 + tolerance
+        )
+        if slower or larger:
+            regressions += 1
+            print(
+                f"REGRESSION {name}: {before['seconds']:.4f}s -> {result['seconds']:.4f}s, "
+                f"{before.get('peak_bytes', 0) / 2**20:.1f} MiB -> {result.get('peak_bytes', 0) / 2**20:.1f} MiB"
+            )
+    return regressions
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Benchmark pixelsort stage by stage.")
+    parser.add_argument(
+        "--sizes",
+        type=float,
+        nargs="+",
+        default=SIZES,
+        help="Image sizes in megapixels",
+    )
+    parser.add_argument(
+        "--super_pixel_sizes", type=int, nargs="+", default=SUPER_PIXEL_SIZES
+    )
+    parser.add_argument("--angles", type=float, nargs="+", default=ANGLES)
+    parser.add_argument(
+        "--intervals",
+        nargs="+",
+        choices=interval_choices.keys(),
+        default=list(interval_choices),
+    )
+    parser.add_argument(
+        "--sorts",
+        nargs="+",
+        choices=sorting_choices.keys(),
+        default=list(sorting_choices),
+    )
+    parser.add_argument(
+        "--repeat",
+        type=int,
+        default=3,
+        help="Runs per measurement, the fastest is kept",
+    )
+    parser.add_argument(
+        "--no_memory",
+        action="store_true",
+        help="Skip the extra traced run for peak memory",
+    )
+    parser.add_argument(
+        "--quick",
+        action="store_true",
+        help="Small sizes and one configuration, for a fast smoke run",
+    )
+    parser.add_argument("--output", help="Write results to this JSON file")
+    parser.add_argument(
+        "--baseline", help="Compare against results from this JSON file"
+    )
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.25,
+        help="Allowed relative slowdown, 0.25 = 25%%",
+    )
+    parser.add_argument(
+        "--min_seconds",
+        type=float,
+        default=0.005,
+        help="Ignore slowdowns smaller than this, as timer noise",
+    )
+    args = parser.parse_args()
+    if args.quick:
+        args.sizes, args.super_pixel_sizes, args.angles, args.repeat = (
+            [0.25, 1],
+            [1],
+            [0],
+            1,
+        )
+    return args
+
+
+def main():
+    args = parse_args()
+    results = run(args)
+    report = {
+        "environment": {
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "pillow": PIL.__version__,
+            "machine": platform.machine(),
+            "processor": platform.processor(),
+            "cpus": os.cpu_count(),
+        },
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as fh:
+            json.dump(report, fh, indent=1)
+    if args.baseline:
+        with open(args.baseline) as fh:
+            baseline = json.load(fh)["results"]
+        regressions = compare(results, baseline, args.tolerance, args.min_seconds)
+        print(f"{regressions} regression(s) against {args.baseline}")
+        sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+"""
+Measures the peak resident memory of pixelsort_array on a generated image, with and without a memory budget, each run
+in a fresh process. Peaks are reported as multiples of the size of the RGBA input, on top of what the process held
+before sorting, and the script fails if a run with a budget exceeds its allowed multiple. Rotations by other than right
+angles are allowed the size of their line map on top, which is kept for later renders at the same angle.
+
+    python benchmarks/memory.py --megapixels 12 --budget 32
+    python benchmarks/memory.py --output memory.json
+"""
+
+import argparse
+import json
+import math
+import os
+import platform
+import subprocess
+import sys
+import typing
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ANGLES = [0, 90, 30]
+
+
+def child(megapixels: float, angle: float, budget: typing.Optional[int]) -> dict:
+    """Runs in a fresh process: sorts a generated RGBA image and returns the peak RSS it took."""
+    sys.path.insert(0, ROOT)
+    import numpy as np
+
+    from pixelsort import pixelsort_array
+    from pixelsort.line_map import line_map
+    from pixelsort.profiling import peak_rss
+
+    width = int(math.sqrt(megapixels * 1e6 * 1.5))
+    height = int(megapixels * 1e6 / width)
+    # Generated in place, so making it does not raise the peak on its own
+    image = np.random.default_rng(0).integers(
+        0, 256, (height, width, 4), dtype=np.uint8
+    )
+    image[..., 3] = 255
+    image[:, ::7, :3] //= 4
+    # Imports and lazily built tables are not part of the measurement
+    pixelsort_array(image[:8, :8], angle=angle)
+
+    before = peak_rss()
+    pixelsort_array(image, angle=angle, seed=0, memory_budget=budget)
+    peak = peak_rss() - before
+    # Cached by the run above
+    map_bytes = line_map((width, height), angle).nbytes if angle % 90 else 0
+    return {
+        "input_bytes": image.nbytes,
+        "peak_bytes": peak,
+        "line_map_bytes": map_bytes,
+    }
+
+
+def measure(megapixels: float, angle: float, budget: typing.Optional[int]) -> dict:
+    process = subprocess.run(
+        [sys.executable, __file__, "--child", json.dumps([megapixels, angle, budget])],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    result = json.loads(process.stdout)
+    result["ratio"] = result["peak_bytes"] / result["input_bytes"]
+    return result
+
+
+def run(args: argparse.Namespace) -> typing.Tuple[dict, int]:
+    """Results of every run, and the number of runs with a budget that exceeded their allowed multiple."""
+    results = {}
+    violations = 0
+    for angle in ANGLES:
+        for budget in (None, args.budget * 2**20):
+            name = f"angle={angle} budget={budget // 2**20 if budget else None}"
+            results[name] = measure(args.megapixels, angle, budget)
+            ratio = results[name]["ratio"]
+            limit = args.max_ratio + (
+                results[name]["line_map_bytes"] / results[name]["input_bytes"]
+            )
+            print(
+                f"{name:<24} peak {results[name]['peak_bytes'] / 2**20:8.1f} MiB "
+                f"{ratio:6.2f}x input",
+                flush=True,
+            )
+            if budget and ratio > limit:
+                violations += 1
+                print(f"REGRESSION {name} uses {ratio:.2f}x the input, over {limit}x")
+    return results, violations
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Benchmark pixelsort peak memory.")
+    parser.add_argument(
+        "--megapixels", type=float, default=12, help="Size of the generated image"
+    )
+    parser.add_argument(
+        "--budget", type=int, default=32, help="Memory budget in megabytes"
+    )
+    parser.add_argument(
+        "--max_ratio",
+        type=float,
+        default=4,
+        help="Largest peak with a budget, as a multiple of the RGBA input's size, on top of the line map at angles "
+        "other than right ones",
+    )
+    parser.add_argument("--output", help="Write results to this JSON file")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    if args.child:
+        print(json.dumps(child(*json.loads(args.child))))
+        return
+    if platform.system() == "Windows":
+        sys.exit("Peak RSS is not available on Windows")
+    results, violations = run(args)
+    if args.output:
+        report = {
+            "environment": {
+                "python": platform.python_version(),
+                "machine": platform.machine(),
+                "processor": platform.processor(),
+            },
+            "results": results,
+        }
+        with open(args.output, "w") as fh:
+            json.dump(report, fh, indent=1)
+    sys.exit(1 if violations else 0)
+
+
+if __name__ == "__main__":
+    main()
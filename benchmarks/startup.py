@@ -0,0 +1,170 @@
+"""
+Benchmarks the start up time of pixelsort with python -X importtime, for commands that should not need to load NumPy
+and Pillow (importing the package, --help, argument errors) and for a real sort. For every command it records the
+wall time of the whole process and the cumulative import time of each top level module, and fails if a command that
+should stay light imports a heavy module.
+
+    python benchmarks/startup.py --output startup.json
+    python benchmarks/startup.py --baseline startup.json
+"""
+
+import argparse
+import json
+import math
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import typing
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+EXAMPLE = os.path.join(ROOT, "examples", "image.jpg")
+
+# Modules only a command that processes an image should import.
+HEAVY_MODULES = ("numpy", "PIL")
+
+
+def commands(output_dir: str) -> typing.Dict[str, typing.Tuple[typing.List[str], bool]]:
+    """Benchmarked commands as name: (python arguments, whether they may import heavy modules)."""
+    return {
+        "import": (["-c", "import pixelsort"], False),
+        "help": (["-m", "pixelsort", "--help"], False),
+        "invalid_argument": (["-m", "pixelsort", EXAMPLE, "-s", "invalid"], False),
+        "sort": (
+            ["-m", "pixelsort", EXAMPLE, "-o", os.path.join(output_dir, "out.png")],
+            True,
+        ),
+    }
+
+
+def parse_importtime(stderr: str) -> typing.Dict[str, typing.Tuple[float, int]]:
+    """Cumulative import time in seconds and nesting depth of every module in -X importtime output, by name. Depth 0
+    modules were imported by the command itself."""
+    modules = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:") :].split("|")
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        modules[name.strip()] = (int(cumulative) / 1e6, depth)
+    return modules
+
+
+def measure(arguments: typing.List[str], repeat: int) -> dict:
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    seconds = math.inf
+    imports = {}
+    for _ in range(repeat):
+        start = time.perf_counter()
+        process = subprocess.run(
+            [sys.executable, "-X", "importtime"] + arguments,
+            env=env,
+            capture_output=True,
+            text=True,
+        )
+        elapsed = time.perf_counter() - start
+        if elapsed < seconds:
+            seconds, imports = elapsed, parse_importtime(process.stderr)
+    top_level = {name: value for name, (value, depth) in imports.items() if not depth}
+    return {
+        "seconds": seconds,
+        "import_seconds": sum(top_level.values()),
+        "heavy_modules": [name for name in HEAVY_MODULES if name in imports],
+        "slowest_imports": dict(
+            sorted(top_level.items(), key=lambda item: -item[1])[:10]
+        ),
+    }
+
+
+def run(args: argparse.Namespace) -> typing.Tuple[dict, int]:
+    """Results of every command, and the number of light commands that imported heavy modules."""
+    results = {}
+    violations = 0
+    with tempfile.TemporaryDirectory() as output_dir:
+        for name, (arguments, heavy_allowed) in commands(output_dir).items():
+            results[name] = measure(arguments, args.repeat)
+            heavy = results[name]["heavy_modules"]
+            print(
+                f"{name:<20} {results[name]['seconds']:8.4f}s "
+                f"imports {results[name]['import_seconds']:8.4f}s "
+                f"{'heavy: ' + ', '.join(heavy) if heavy else ''}",
+                flush=True,
+            )
+            if heavy and not heavy_allowed:
+                violations += 1
+                print(f"REGRESSION {name} imports {', '.join(heavy)}")
+    return results, violations
+
+
+def compare(results: dict, baseline: dict, tolerance: float, min_seconds: float) -> int:
+    """Prints every command that got slower to start than the baseline by more than tolerance and returns how many
+    there were."""
+    regressions = 0
+    for name, result in results.items():
+        before = baseline.get(name)
+        if before is None:
+            continue
+        for measurement in ("seconds", "import_seconds"):
+            if result[measurement] > before[measurement] * (1 + tolerance) and (
+                result[measurement] - before[measurement] > min_seconds
+            ):
+                regressions += 1
+                print(
+                    f"REGRESSION {name} {measurement}: {before[measurement]:.4f}s -> {result[measurement]:.4f}s"
+                )
+    return regressions
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Benchmark pixelsort start up time.")
+    parser.add_argument(
+        "--repeat",
+        type=int,
+        default=5,
+        help="Runs per command, the fastest is kept",
+    )
+    parser.add_argument("--output", help="Write results to this JSON file")
+    parser.add_argument(
+        "--baseline", help="Compare against results from this JSON file"
+    )
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.25,
+        help="Allowed relative slowdown, 0.25 = 25%%",
+    )
+    parser.add_argument(
+        "--min_seconds",
+        type=float,
+        default=0.01,
+        help="Ignore slowdowns smaller than this, as timer noise",
+    )
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    results, regressions = run(args)
+    report = {
+        "environment": {
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "processor": platform.processor(),
+        },
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as fh:
+            json.dump(report, fh, indent=1)
+    if args.baseline:
+        with open(args.baseline) as fh:
+            baseline = json.load(fh)["results"]
+        regressions += compare(results, baseline, args.tolerance, args.min_seconds)
+        print(f"{regressions} regression(s) against {args.baseline}")
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
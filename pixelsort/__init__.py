@@ -1,3 +1,30 @@
-from pixelsort.main import pixelsort
+import importlib
 
 NAME = "pixelsort"
+
+# Public functions and the modules defining them. They are imported on first
+# use, so importing pixelsort, e.g. to parse command line arguments, does not
+# load NumPy and Pillow.
+_EXPORTS = {
+    "pixelsort": "pixelsort.main",
+    "pixelsort_array": "pixelsort.main",
+    "pixelsort_async": "pixelsort.aio",
+    "pixelsort_frames": "pixelsort.sequence",
+    "pixelsort_passes": "pixelsort.pipeline",
+    "pixelsort_stream": "pixelsort.stream",
+    "pixelsort_sweep": "pixelsort.sweep",
+}
+
+__all__ = list(_EXPORTS)
+
+
+def __getattr__(name: str):
+    if name not in _EXPORTS:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(_EXPORTS[name]), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(list(globals()) + __all__)
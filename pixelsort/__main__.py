@@ -1,16 +1,128 @@
-import os
-from PIL import Image
 import logging
+import os
+import sys
+
 from pixelsort.argparams import parse_args
-from pixelsort.main import pixelsort
-from pixelsort.util import id_generator
+
+if sys.argv[1:2] == ["serve"]:
+    from pixelsort.server import main
+
+    main(sys.argv[2:])
+    sys.exit(0)
 
 args = parse_args()
-image_input_path = args.pop("image_input_path")
+
+# Imported only now, so --help and invalid arguments do not pay for loading
+# NumPy and Pillow.
+import json  # noqa: E402
+
+import numpy as np  # noqa: E402
+from PIL import Image  # noqa: E402
+
+from pixelsort.batch import find_images, is_batch, sort_files  # noqa: E402
+from pixelsort.disk_cache import DiskCache  # noqa: E402
+from pixelsort.main import pixelsort_array  # noqa: E402
+from pixelsort.pipeline import PASS_PARAMETERS, pixelsort_passes  # noqa: E402
+from pixelsort.preview import Preview  # noqa: E402
+from pixelsort.profiling import Profile, peak_rss  # noqa: E402
+from pixelsort.sequence import (  # noqa: E402
+    is_animated,
+    load_frames,
+    pixelsort_frames,
+    save_frames,
+)
+from pixelsort.stream import pixelsort_stream  # noqa: E402
+from pixelsort.sweep import (  # noqa: E402
+    pixelsort_sweep,
+    save_sweep,
+    varying_parameters,
+)
+from pixelsort.util import id_generator, open_output, save_image  # noqa: E402
+
+image_input_paths = args.pop("image_input_paths")
 image_output_path = args.pop("image_output_path")
 interval_file_path = args.pop("interval_file_path")
 mask_path = args.pop("mask_path")
+memory_budget = args.pop("memory_budget")
+jobs = args.pop("jobs")
+overwrite = args.pop("overwrite")
+sequence = args.pop("sequence")
+sweep = args.pop("sweep")
+passes = args.pop("passes")
+preview = args.pop("preview")
+stream = args.pop("stream")
+pixel_format = args.pop("pixel_format")
+profile_path = args.pop("profile")
+cache_dir = args.pop("cache_dir")
+cache_limit = args.pop("cache_limit")
+if cache_dir:
+    args["cache"] = DiskCache(cache_dir, cache_limit * 2**20)
+args["memory_budget"] = memory_budget * 2**20 if memory_budget else None
+
+if stream:
+    if mask_path:
+        args["mask_image"] = Image.open(mask_path)
+    if interval_file_path:
+        args["interval_image"] = Image.open(interval_file_path)
+    try:
+        count = pixelsort_stream(
+            sys.stdin.buffer, sys.stdout.buffer, stream, pixel_format, **args
+        )
+    except BrokenPipeError:
+        # The reading end closed early; stdout is pointed at devnull so
+        # Python does not fail flushing it again on exit.
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+        sys.exit(1)
+    logging.info(f"Sorted {count} frames")
+    sys.exit(0)
+
+if sequence or is_animated(image_input_paths):
+    frames, save_options = load_frames(find_images(image_input_paths))
+    if image_output_path is None:
+        os.makedirs("out/", exist_ok=True)
+        image_output_path = f"out/{id_generator()}.gif"
+        logging.warning("No output path provided, using " + image_output_path)
+    if mask_path:
+        args["mask_image"] = Image.open(mask_path)
+    if interval_file_path:
+        args["interval_image"] = Image.open(interval_file_path)
+    args.pop("workers")
+    frames = pixelsort_frames(frames, workers=jobs, **args)
+    logging.debug("Saving frames...")
+    save_frames(frames, image_output_path, **save_options)
+    sys.exit(0)
+
+if sweep:
+    image_input_path = image_input_paths[0]
+    stem, extension = os.path.splitext(os.path.basename(image_input_path))
+    image = Image.open(image_input_path)
+    if mask_path:
+        args["mask_image"] = Image.open(mask_path)
+    if interval_file_path:
+        args["interval_image"] = Image.open(interval_file_path)
+    args.update(sweep)
+    save_sweep(
+        pixelsort_sweep(image, **args),
+        image_output_path or "out/",
+        stem,
+        varying=varying_parameters(sweep),
+        extension=extension or ".png",
+    )
+    sys.exit(0)
 
+if is_batch(image_input_paths):
+    failures = sort_files(
+        image_input_paths,
+        output_dir=image_output_path or "out/",
+        jobs=jobs,
+        mask_path=mask_path,
+        interval_file_path=interval_file_path,
+        overwrite=overwrite,
+        **args,
+    )
+    sys.exit(1 if failures else 0)
+
+image_input_path = image_input_paths[0]
 if image_output_path is None:
     if not os.path.exists("out/"):
         os.mkdir("out/")
@@ -19,7 +131,10 @@ if image_output_path is None:
     logging.warning("No output path provided, using " + image_output_path)
 
 logging.debug("Opening image...")
-args["image"] = Image.open(image_input_path)
+if image_input_path.lower().endswith(".npy"):
+    args["image"] = np.load(image_input_path, mmap_mode="r")
+else:
+    args["image"] = Image.open(image_input_path)
 if mask_path:
     logging.debug("Opening mask...")
     args["mask_image"] = Image.open(mask_path)
@@ -27,9 +142,43 @@ if interval_file_path:
     logging.debug("Opening interval file...")
     args["interval_image"] = Image.open(interval_file_path)
 
-image = pixelsort(**args)
-logging.debug("Saving image...")
-if os.path.splitext(image_output_path)[1].lower() in (".jpg", ".jpeg"):
-    # JPEG has no alpha channel
-    image = image.convert("RGB")
-image.save(image_output_path)
+if profile_path:
+    args["profile"] = Profile()
+
+out = None
+if image_output_path.lower().endswith(".npy"):
+    out = open_output(image_output_path, args["image"])
+if passes:
+    # The other options are the defaults of every pass.
+    defaults = {name: args.pop(name) for name in PASS_PARAMETERS}
+    passes = [{**defaults, **parameters} for parameters in passes]
+    result = np.asarray(pixelsort_passes(passes=passes, **args))
+    if out is not None:
+        out[...] = result
+elif preview:
+    parameters = {name: args.pop(name) for name in PASS_PARAMETERS}
+    stem, extension = os.path.splitext(image_output_path)
+    preview_path = f"{stem}.preview{'.png' if out is not None else extension}"
+    with Preview(args.pop("image"), latency=preview, **args) as session:
+        # The full render starts in the background while the preview is saved
+        save_image(session.render(**parameters), preview_path)
+        logging.warning("Preview saved to " + preview_path)
+        result = np.asarray(session.refine())
+    if out is not None:
+        out[...] = result
+else:
+    result = pixelsort_array(out=out, **args)
+if out is not None:
+    out.flush()
+else:
+    logging.debug("Saving image...")
+    save_image(Image.fromarray(result, "RGBA"), image_output_path)
+
+if memory_budget and peak_rss() is not None:
+    logging.info(f"Peak RSS: {peak_rss() / 2**20:.0f} MiB")
+
+if profile_path == "-":
+    print(args["profile"].table(), file=sys.stderr)
+elif profile_path:
+    with open(profile_path, "w") as fh:
+        json.dump(args["profile"].as_dict(), fh, indent=1)
@@ -0,0 +1,243 @@
+import asyncio
+import concurrent.futures
+import multiprocessing
+import threading
+import typing
+
+from PIL import Image
+
+from pixelsort.main import pixelsort
+from pixelsort.profiling import Profile, stage
+from pixelsort.util import decode_image, encode_image
+
+# Cancellation flags of a process executor, set in every worker process by
+# _init_worker.
+_process_flags = None
+# AsyncSorter of pixelsort_async, made on first use.
+_default_sorter = None
+
+
+class AsyncSorter:
+    """
+    Runs pixelsort for asyncio code on a pool of threads or processes, without blocking the event loop.
+
+    At most concurrency renders run at once and queue_size more wait for a free worker. Submitting more raises
+    asyncio.QueueFull right away, so a loaded service can turn requests away instead of letting their latency grow.
+    Cancelling the task awaiting a render drops it if it has not started, and stops it at the start of its next stage
+    (e.g. determining intervals, sorting or placing pixels) if it has. Its place only frees up once it has stopped.
+
+    >>> async with AsyncSorter(concurrency=4, queue_size=16) as sorter:
+    ...     png = await sorter.pixelsort_bytes(data, angle=90)
+    ...     image = await sorter.pixelsort(await sorter.decode(data), seed=0)
+    """
+
+    def __init__(
+        self, concurrency: int = 1, queue_size: int = 16, processes: bool = False
+    ):
+        """
+        :param concurrency: number of renders running at once, i.e. worker threads or processes
+        :param queue_size: number of renders waiting for a worker before new ones are rejected
+        :param processes: run renders in worker processes instead of threads. Images and results are then pickled to
+            and from the workers, so pixelsort_bytes, which only sends encoded images, suits them best.
+        """
+        self.concurrency = concurrency
+        self.queue_size = queue_size
+        self.processes = processes
+        places = concurrency + queue_size
+        if processes:
+            # Shared with the workers when they start
+            self._flags = multiprocessing.Array("b", places, lock=False)
+            self._executor = concurrent.futures.ProcessPoolExecutor(
+                concurrency, initializer=_init_worker, initargs=(self._flags,)
+            )
+        else:
+            self._flags = bytearray(places)
+            self._executor = concurrent.futures.ThreadPoolExecutor(
+                concurrency, thread_name_prefix="pixelsort"
+            )
+        # Places are freed by the executor's threads when a render is done
+        self._lock = threading.Lock()
+        self._free = list(range(places))
+
+    @property
+    def pending(self) -> int:
+        """Number of renders running or waiting for a worker."""
+        with self._lock:
+            return self.concurrency + self.queue_size - len(self._free)
+
+    async def pixelsort(self, image: Image.Image, **parameters) -> Image.Image:
+        """
+        pixelsort() on a worker.
+        :param image: image to pixelsort
+        :param parameters: keyword arguments of pixelsort(), e.g. mask_image or angle. A profile is only filled in with
+            thread workers.
+        :return: pixelsorted image
+        """
+        return await self._run(pixelsort, image, **parameters)
+
+    async def pixelsort_bytes(
+        self,
+        image: bytes,
+        image_format: str = "png",
+        mask_image: typing.Optional[bytes] = None,
+        interval_image: typing.Optional[bytes] = None,
+        **parameters,
+    ) -> bytes:
+        """
+        Decodes an encoded image, pixelsorts it and encodes the result, all on one worker.
+        :param image: encoded image, e.g. the body of a request
+        :param image_format: format or file extension to encode the result in, e.g. png, jpg or webp
+        :param mask_image: encoded mask image
+        :param interval_image: encoded interval image
+        :param parameters: other keyword arguments of pixelsort()
+        :return: the encoded result
+        """
+        return await self._run(
+            _render_bytes, image, image_format, mask_image, interval_image, **parameters
+        )
+
+    async def decode(self, data: bytes) -> Image.Image:
+        """Decodes an image on a worker."""
+        return await self._run(_decode, data)
+
+    async def encode(self, image: Image.Image, image_format: str = "png") -> bytes:
+        """Encodes an image in image_format, e.g. png or jpg, on a worker. JPEG drops the alpha channel."""
+        return await self._run(_encode, image, image_format)
+
+    def close(self):
+        """Stops running renders at their next stage and drops waiting ones, without waiting for them."""
+        self._flags[:] = b"\1" * len(self._flags)
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    async def __aenter__(self) -> "AsyncSorter":
+        return self
+
+    async def __aexit__(self, *_):
+        self.close()
+
+    async def _run(self, function: typing.Callable, *args, **parameters):
+        if self.processes and parameters.get("profile") is not None:
+            raise ValueError("profiles are only filled in with thread workers")
+        if "cancel_check" in parameters:
+            raise ValueError("renders are stopped by cancelling the awaiting task")
+        with self._lock:
+            if not self._free:
+                raise asyncio.QueueFull(
+                    f"{self.concurrency + self.queue_size} renders already pending"
+                )
+            place = self._free.pop()
+        self._flags[place] = 0
+        future = self._executor.submit(
+            _call,
+            function,
+            place,
+            None if self.processes else self._flags,
+            *args,
+            **parameters,
+        )
+        future.add_done_callback(lambda _: self._release(place))
+        try:
+            return await asyncio.wrap_future(future)
+        except asyncio.CancelledError:
+            # Drops it if it has not started, and otherwise stops it at its
+            # next stage
+            future.cancel()
+            self._flags[place] = 1
+            raise
+
+    def _release(self, place: int):
+        with self._lock:
+            self._free.append(place)
+
+
+async def pixelsort_async(
+    image: Image.Image, sorter: typing.Optional[AsyncSorter] = None, **parameters
+) -> Image.Image:
+    """
+    pixelsorts an image without blocking the event loop.
+    :param image: image to pixelsort
+    :param sorter: AsyncSorter to run on, which sets the number of concurrent renders and the queue size. A shared one
+        running one render at a time on a thread by default.
+    :param parameters: keyword arguments of pixelsort()
+    :return: pixelsorted image
+    """
+    global _default_sorter
+    if sorter is None:
+        if _default_sorter is None:
+            _default_sorter = AsyncSorter()
+        sorter = _default_sorter
+    return await sorter.pixelsort(image, **parameters)
+
+
+class _Cancellation:
+    """cancel_check of a render on a worker: stops it between two stages once its flag is set."""
+
+    def __init__(self, flags, place: int):
+        self.flags = flags
+        self.place = place
+
+    def __call__(self):
+        if self.flags[self.place]:
+            # Reaches the caller, if it is still waiting, as asyncio.CancelledError
+            raise concurrent.futures.CancelledError()
+
+
+def _init_worker(flags):
+    global _process_flags
+    _process_flags = flags
+
+
+def _call(function: typing.Callable, place: int, flags, *args, **parameters):
+    """Runs on a worker: function(*args, **parameters), stopped between stages once place is cancelled."""
+    cancel_check = _Cancellation(flags if flags is not None else _process_flags, place)
+    cancel_check()
+    return function(*args, cancel_check=cancel_check, **parameters)
+
+
+def _decode(
+    data: bytes,
+    profile: typing.Optional[Profile] = None,
+    cancel_check: typing.Optional[typing.Callable[[], None]] = None,
+) -> Image.Image:
+    if cancel_check is not None:
+        cancel_check()
+    with stage(profile, "decode"):
+        # Decoded here rather than on first use in the event loop
+        return decode_image(data)
+
+
+def _encode(
+    image: Image.Image,
+    image_format: str,
+    profile: typing.Optional[Profile] = None,
+    cancel_check: typing.Optional[typing.Callable[[], None]] = None,
+) -> bytes:
+    if cancel_check is not None:
+        cancel_check()
+    with stage(profile, "encode"):
+        return encode_image(image, image_format)
+
+
+def _render_bytes(
+    image: bytes,
+    image_format: str,
+    mask_image: typing.Optional[bytes],
+    interval_image: typing.Optional[bytes],
+    profile: typing.Optional[Profile] = None,
+    cancel_check: typing.Optional[typing.Callable[[], None]] = None,
+    **parameters,
+) -> bytes:
+    image = _decode(image, profile, cancel_check)
+    mask_image = _decode(mask_image, profile, cancel_check) if mask_image else None
+    interval_image = (
+        _decode(interval_image, profile, cancel_check) if interval_image else None
+    )
+    result = pixelsort(
+        image,
+        mask_image=mask_image,
+        interval_image=interval_image,
+        profile=profile,
+        cancel_check=cancel_check,
+        **parameters,
+    )
+    return _encode(result, image_format, profile, cancel_check)
@@ -1,21 +1,31 @@
 import argparse
 import logging
 
-from pixelsort.constants import DEFAULTS
-from pixelsort.interval import interval_choices
-from pixelsort.sorting import sorting_choices
+from pixelsort.constants import (
+    DEFAULTS,
+    DIRECTIONS,
+    INTERVAL_FUNCTIONS,
+    LOG_FORMAT,
+    SORTING_FUNCTIONS,
+)
 
 
 def parse_args():
     parser = argparse.ArgumentParser(description="Pixel mangle an image.")
-    parser.add_argument("image", help="Input image file path.")
     parser.add_argument(
-        "-o", "--output", help="Output image file path, DEFAULTS to the time created."
+        "image",
+        nargs="*",
+        help="Input image file path. Several paths, directories or glob patterns sort a batch of images.",
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        help="Output image file path, DEFAULTS to the time created. In batch mode, the output directory.",
     )
     parser.add_argument(
         "-i",
         "--int_function",
-        choices=interval_choices.keys(),
+        choices=INTERVAL_FUNCTIONS,
         default=DEFAULTS["interval_function"],
         help="Function to determine sorting intervals",
     )
@@ -47,6 +57,12 @@ def parse_args():
         default=DEFAULTS["angle"],
         help="Rotate the image by an angle (in degrees) before sorting",
     )
+    parser.add_argument(
+        "-d",
+        "--direction",
+        choices=DIRECTIONS.keys(),
+        help="Direction to sort in, instead of an angle. Right angles are sorted without rotating the image.",
+    )
     parser.add_argument(
         "-p",
         "--super_pixel_size",
@@ -65,13 +81,114 @@ def parse_args():
     parser.add_argument(
         "-s",
         "--sorting_function",
-        choices=sorting_choices.keys(),
+        choices=SORTING_FUNCTIONS,
         default=DEFAULTS["sorting_function"],
         help="Function to sort pixels by.",
     )
     parser.add_argument(
         "-m", "--mask", help="Image used for masking parts of the image"
     )
+    parser.add_argument(
+        "--seed",
+        type=int,
+        help="Seed for random intervals and randomness, for reproducible output",
+    )
+    parser.add_argument(
+        "-b",
+        "--memory_budget",
+        type=int,
+        help="Keep the temporary arrays of sorting to about this many megabytes by sorting a band of sort lines at a "
+        "time. Input and output may be .npy files, which are memory-mapped and, at right angles, never held in memory "
+        "whole. Logs the peak RSS.",
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=1,
+        help="Number of worker processes in batch mode, or frames sorted at once in sequence mode",
+    )
+    parser.add_argument(
+        "--threads",
+        type=int,
+        default=1,
+        help="Number of threads sorting bands of rows of each image. Frames in sequence mode are parallelized with -j "
+        "instead.",
+    )
+    parser.add_argument(
+        "--sequence",
+        action="store_true",
+        help="Treat the inputs as the frames of one animation. Implied for a single multi-frame input.",
+    )
+    parser.add_argument(
+        "--overwrite",
+        action="store_true",
+        help="In batch mode, sort images whose output already exists instead of skipping them",
+    )
+    parser.add_argument(
+        "--sweep",
+        action="append",
+        type=_sweep_option,
+        metavar="NAME=VALUES",
+        help="Sort once for every combination of parameter values, e.g. lower_threshold=0.1:0.5:0.1 or "
+        "sorting_function=hue,lightness. Repeat for several parameters. Results and a contact sheet are written to "
+        "the output directory.",
+    )
+    parser.add_argument(
+        "--pass",
+        action="append",
+        type=_pass_option,
+        dest="passes",
+        metavar="NAME=VALUE,...",
+        help="Sort several times in a row, e.g. --pass angle=90 --pass angle=0,sorting_function=hue. Parameters a pass "
+        "leaves out take the values given by the other options. Only the final result is saved.",
+    )
+    parser.add_argument(
+        "--preview",
+        nargs="?",
+        type=float,
+        const=0.5,
+        metavar="SECONDS",
+        help="First save a preview at reduced resolution, rendered in about SECONDS (0.5 by default), next to the "
+        "output as NAME.preview.EXT, then the full resolution result.",
+    )
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="Read raw frames of --size from stdin and write the sorted frames to stdout in the same format, e.g. "
+        "between ffmpeg -f rawvideo commands. Takes no input paths.",
+    )
+    parser.add_argument(
+        "--size",
+        type=_size_option,
+        metavar="WxH",
+        help="Width and height of the frames in --stream mode",
+    )
+    parser.add_argument(
+        "--pix_fmt",
+        choices=["rgb24", "rgba"],
+        default="rgb24",
+        help="Pixel format of the frames in --stream mode, as in ffmpeg",
+    )
+    parser.add_argument(
+        "--cache",
+        metavar="DIR",
+        help="Keep the rotated image, super pixels, sort keys and static intervals in this directory, so runs on the "
+        "same image with other parameters skip recomputing them",
+    )
+    parser.add_argument(
+        "--cache_limit",
+        type=int,
+        default=DEFAULTS["cache_limit"] // 2**20,
+        help="Size of the cache directory in megabytes, beyond which the least recently used entries are deleted",
+    )
+    parser.add_argument(
+        "--profile",
+        nargs="?",
+        const="-",
+        metavar="PATH",
+        help="Record the time and memory used by each stage. Prints a table, or writes JSON to PATH if given.",
+    )
     parser.add_argument(
         "-l",
         "--log_level",
@@ -81,23 +198,154 @@ def parse_args():
     )
 
     _args = parser.parse_args()
+    if _args.stream:
+        if _args.image:
+            parser.error("--stream reads frames from stdin and takes no input paths")
+        if _args.size is None:
+            parser.error("--stream needs the --size of the frames")
+    elif not _args.image:
+        parser.error("the following arguments are required: image")
+    _check_single_image_options(parser, _args)
 
     logging.basicConfig(
-        format="%(name)s: %(levelname)s - %(message)s",
+        format=LOG_FORMAT,
         level=logging.getLevelName(_args.log_level),
     )
 
     return {
-        "image_input_path": _args.image,
+        "image_input_paths": _args.image,
         "image_output_path": _args.output,
         "interval_function": _args.int_function,
         "interval_file_path": _args.int_file,
         "lower_threshold": _args.threshold,
         "upper_threshold": _args.upper_threshold,
         "char_length": _args.char_length,
-        "angle": _args.angle,
+        "angle": (
+            DIRECTIONS[_args.direction] if _args.direction is not None else _args.angle
+        ),
         "super_pixel_size": _args.super_pixel_size,
         "randomness": _args.randomness,
         "sorting_function": _args.sorting_function,
         "mask_path": _args.mask,
+        "seed": _args.seed,
+        "memory_budget": _args.memory_budget,
+        "jobs": _args.jobs,
+        "workers": _args.threads,
+        "sequence": _args.sequence,
+        "sweep": dict(_args.sweep) if _args.sweep else None,
+        "passes": _args.passes,
+        "preview": _args.preview,
+        "stream": _args.size if _args.stream else None,
+        "pixel_format": _args.pix_fmt,
+        "overwrite": _args.overwrite,
+        "profile": _args.profile,
+        "cache_dir": _args.cache,
+        "cache_limit": _args.cache_limit,
     }
+
+
+_SWEEP_TYPES = {
+    "angle": float,
+    "super_pixel_size": int,
+    "interval_function": INTERVAL_FUNCTIONS,
+    "lower_threshold": float,
+    "upper_threshold": float,
+    "char_length": int,
+    "sorting_function": SORTING_FUNCTIONS,
+    "randomness": float,
+}
+
+
+def _sweep_option(text: str):
+    """Parses NAME=VALUES, where VALUES is a comma separated list or, for numbers, an inclusive start:stop:step
+    range."""
+    name, _, values = text.partition("=")
+    if name not in _SWEEP_TYPES or not values:
+        raise argparse.ArgumentTypeError(
+            f"expected NAME=VALUES with NAME one of {', '.join(_SWEEP_TYPES)}"
+        )
+    value_type = _SWEEP_TYPES[name]
+    if isinstance(value_type, tuple):
+        choices = values.split(",")
+        unknown = [choice for choice in choices if choice not in value_type]
+        if unknown:
+            raise argparse.ArgumentTypeError(f"invalid {name}: {', '.join(unknown)}")
+        return name, choices
+    try:
+        if ":" in values:
+            start, stop, step = (value_type(part) for part in values.split(":"))
+            count = int(round((stop - start) / step)) + 1
+            return name, [
+                value_type(round(start + i * step, 10)) for i in range(max(count, 0))
+            ]
+        return name, [value_type(value) for value in values.split(",")]
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid values for {name}: {values}")
+
+
+def _pass_option(text: str):
+    """Parses comma separated NAME=VALUE pairs of the parameters of one pass."""
+    parameters = {}
+    for pair in text.split(","):
+        name, _, value = pair.partition("=")
+        if name not in _SWEEP_TYPES or not value:
+            raise argparse.ArgumentTypeError(
+                f"expected NAME=VALUE with NAME one of {', '.join(_SWEEP_TYPES)}"
+            )
+        value_type = _SWEEP_TYPES[name]
+        if isinstance(value_type, tuple):
+            if value not in value_type:
+                raise argparse.ArgumentTypeError(f"invalid {name}: {value}")
+            parameters[name] = value
+            continue
+        try:
+            parameters[name] = value_type(value)
+        except ValueError:
+            raise argparse.ArgumentTypeError(f"invalid value for {name}: {value}")
+    return parameters
+
+
+def _check_single_image_options(
+    parser: argparse.ArgumentParser, args: argparse.Namespace
+):
+    """Rejects options that only apply to sorting a single image in the other modes, which would drop them."""
+    options = [
+        option
+        for option, value in (
+            ("--pass", args.passes),
+            ("--preview", args.preview),
+            ("--profile", args.profile),
+        )
+        if value is not None
+    ]
+    if not options:
+        return
+    if args.passes and args.preview is not None:
+        parser.error("--pass cannot be used with --preview")
+    for mode, enabled in (
+        ("--stream", args.stream),
+        ("--sequence", args.sequence),
+        ("--sweep", args.sweep),
+    ):
+        if enabled:
+            parser.error(f"{options[0]} cannot be used with {mode}")
+    # Imported only now, as they load NumPy and Pillow
+    from pixelsort.batch import is_batch
+    from pixelsort.sequence import is_animated
+
+    if is_animated(args.image):
+        parser.error(f"{options[0]} cannot be used with an animated input")
+    if is_batch(args.image):
+        parser.error(f"{options[0]} only applies to a single input image")
+
+
+def _size_option(text: str):
+    """Parses WIDTHxHEIGHT."""
+    width, _, height = text.lower().partition("x")
+    try:
+        size = int(width), int(height)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected WIDTHxHEIGHT, got {text}")
+    if min(size) <= 0:
+        raise argparse.ArgumentTypeError(f"invalid size: {text}")
+    return size
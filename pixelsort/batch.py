@@ -0,0 +1,197 @@
+import glob
+import logging
+import os
+import typing
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+
+from PIL import Image
+
+from pixelsort.constants import LOG_FORMAT
+from pixelsort.main import pixelsort
+from pixelsort.util import save_image
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".bmp", ".gif", ".tif", ".tiff", ".webp")
+
+
+def is_batch(paths: typing.Sequence[str]) -> bool:
+    """Whether the given input paths call for batch mode rather than a single image."""
+    return len(paths) > 1 or any(
+        os.path.isdir(path) or glob.has_magic(path) for path in paths
+    )
+
+
+def find_images(paths: typing.Sequence[str]) -> typing.List[str]:
+    """
+    Expands input paths into image files. Directories contribute the image files directly inside them and glob
+    patterns the files they match, both in sorted order; plain paths are kept as they are. Duplicates are dropped.
+    :param paths: files, directories or glob patterns
+    :return: image file paths
+    """
+    found = []
+    for path in paths:
+        if os.path.isdir(path):
+            matches = sorted(
+                os.path.join(path, name)
+                for name in os.listdir(path)
+                if os.path.splitext(name)[1].lower() in IMAGE_EXTENSIONS
+            )
+        elif glob.has_magic(path):
+            matches = sorted(
+                match for match in glob.glob(path) if os.path.isfile(match)
+            )
+        else:
+            matches = [path]
+        found.extend(match for match in matches if match not in found)
+    return found
+
+
+def sort_files(
+    paths: typing.Sequence[str],
+    output_dir: str,
+    jobs: int = 1,
+    mask_path: typing.Optional[str] = None,
+    interval_file_path: typing.Optional[str] = None,
+    overwrite: bool = False,
+    **options,
+) -> int:
+    """
+    Pixelsorts many images with the same options, writing each result under output_dir with its input file name.
+    Inputs from different directories that share a file name keep their paths relative to the directories' common
+    parent instead. Outputs that already exist are skipped unless overwrite is set, so an interrupted run can simply
+    be restarted.
+    :param paths: files, directories or glob patterns, see find_images
+    :param output_dir: directory to write results to, created if needed
+    :param jobs: number of worker processes
+    :param mask_path: mask image applied to every input
+    :param interval_file_path: interval image applied to every input
+    :param overwrite: sort inputs whose output already exists
+    :param options: remaining keyword arguments for pixelsort
+    :return: number of images that failed
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    tasks = []
+    for path, name in _output_names(find_images(paths)):
+        output_path = os.path.join(output_dir, name)
+        os.makedirs(os.path.dirname(output_path), exist_ok=True)
+        if not overwrite and os.path.exists(output_path):
+            logging.info(f"Skipping {path}, {output_path} already exists")
+        else:
+            tasks.append((path, output_path))
+    logging.info(f"Sorting {len(tasks)} images with {jobs} worker(s)...")
+
+    if jobs <= 1 or len(tasks) <= 1:
+        failures = _sort_tasks(tasks, mask_path, interval_file_path, options)
+    else:
+        jobs = min(jobs, len(tasks))
+        # Every worker gets an interleaved share and pipelines it on its own, so
+        # per-image data never has to be pickled between processes.
+        with ProcessPoolExecutor(
+            max_workers=jobs,
+            initializer=_init_worker,
+            initargs=(logging.getLogger().level,),
+        ) as pool:
+            shares = [
+                pool.submit(
+                    _sort_tasks, tasks[i::jobs], mask_path, interval_file_path, options
+                )
+                for i in range(jobs)
+            ]
+            failures = [failure for share in shares for failure in share.result()]
+
+    logging.info(f"Sorted {len(tasks) - len(failures)} of {len(tasks)} images")
+    if failures:
+        logging.error(
+            f"{len(failures)} image(s) failed: "
+            + ", ".join(path for path, _ in failures)
+        )
+    return len(failures)
+
+
+def _output_names(paths: typing.Sequence[str]) -> typing.List[typing.Tuple[str, str]]:
+    """Pairs every input path with its output path relative to the output directory: its file name, or its path
+    relative to the common parent of all inputs if other inputs have the same file name. Raises ValueError if two
+    inputs still map to the same output, e.g. the same file given twice under different paths.
+    """
+    names = [os.path.basename(path) for path in paths]
+    clashing = {name for name in names if names.count(name) > 1}
+    if clashing:
+        absolute = [os.path.abspath(path) for path in paths]
+        root = os.path.commonpath([os.path.dirname(path) for path in absolute])
+        names = [
+            os.path.relpath(path, root) if name in clashing else name
+            for path, name in zip(absolute, names)
+        ]
+    seen = {}
+    for path, name in zip(paths, names):
+        if os.path.normcase(name) in seen:
+            raise ValueError(
+                f"{seen[os.path.normcase(name)]} and {path} would both be written to {name}"
+            )
+        seen[os.path.normcase(name)] = path
+    return list(zip(paths, names))
+
+
+def _init_worker(log_level: int):
+    logging.basicConfig(format=LOG_FORMAT, level=log_level)
+
+
+def _load_image(path: str) -> Image.Image:
+    image = Image.open(path)
+    # Decode now, on the loading thread, rather than lazily on first access.
+    image.load()
+    return image
+
+
+def _sort_tasks(
+    tasks: typing.Sequence[typing.Tuple[str, str]],
+    mask_path: typing.Optional[str],
+    interval_file_path: typing.Optional[str],
+    options: dict,
+) -> typing.List[typing.Tuple[str, str]]:
+    """Sorts (input, output) path pairs in order. While one image is being sorted, the next one is decoded and the
+    previous result encoded on helper threads. Failures are logged as they happen and returned as (input, error
+    message) pairs."""
+    if mask_path:
+        options = dict(options, mask_image=_load_image(mask_path))
+    if interval_file_path:
+        options = dict(options, interval_image=_load_image(interval_file_path))
+
+    failures = []
+    pending: typing.Optional[typing.Tuple[str, Future]] = None
+    with ThreadPoolExecutor(max_workers=1) as reader, ThreadPoolExecutor(
+        max_workers=1
+    ) as writer:
+        loads = [reader.submit(_load_image, path) for path, _ in tasks[:1]]
+        for i, (path, output_path) in enumerate(tasks):
+            if i + 1 < len(tasks):
+                loads.append(reader.submit(_load_image, tasks[i + 1][0]))
+            try:
+                result = pixelsort(loads[i].result(), **options)
+            except Exception as e:
+                failures.append(_failure(path, e))
+                continue
+            finally:
+                loads[i] = None
+
+            # At most one encode in flight, so finished images cannot pile up.
+            if pending:
+                failures.extend(_wait_for_save(*pending))
+            pending = (path, writer.submit(save_image, result, output_path))
+            logging.info(f"Sorted {path} -> {output_path}")
+        if pending:
+            failures.extend(_wait_for_save(*pending))
+    return failures
+
+
+def _wait_for_save(path: str, save: Future) -> typing.List[typing.Tuple[str, str]]:
+    try:
+        save.result()
+    except Exception as e:
+        return [_failure(path, e)]
+    return []
+
+
+def _failure(path: str, error: Exception) -> typing.Tuple[str, str]:
+    message = f"{type(error).__name__}: {error}"
+    logging.error(f"Failed to sort {path}: {message}")
+    return path, message
@@ -7,4 +7,35 @@ DEFAULTS = {
     "randomness": 0,
     "sorting_function": "lightness",
     "super_pixel_size": 1,
+    "cache_limit": 2**30,
 }
+
+# Parameters grouped by the stage they invalidate: a new geometry needs a new
+# rotated SuperPixelImage, new interval parameters only new intervals, and the
+# sorting parameters only a new sort.
+GEOMETRY_PARAMETERS = ("angle", "super_pixel_size")
+INTERVAL_PARAMETERS = (
+    "interval_function",
+    "lower_threshold",
+    "upper_threshold",
+    "char_length",
+)
+SORTING_PARAMETERS = ("sorting_function", "randomness")
+
+# Names of the interval and sorting functions, in the order of interval_choices
+# and sorting_choices, for code that must not import NumPy, like the CLI parser.
+INTERVAL_FUNCTIONS = (
+    "random",
+    "threshold",
+    "edges",
+    "waves",
+    "file",
+    "file-edges",
+    "none",
+)
+SORTING_FUNCTIONS = ("lightness", "hue", "intensity", "minimum", "saturation")
+
+# Sorting directions as angles: rows are sorted left to right after rotating the image counterclockwise by the angle.
+DIRECTIONS = {"right": 0, "up": 90, "left": 180, "down": 270}
+
+LOG_FORMAT = "%(name)s: %(levelname)s - %(message)s"
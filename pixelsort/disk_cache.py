@@ -0,0 +1,112 @@
+import hashlib
+import json
+import logging
+import os
+import typing
+
+import numpy as np
+from PIL import Image
+
+from pixelsort.constants import DEFAULTS
+
+
+class DiskCache:
+    """
+    Directory of intermediate arrays stored as .npy files, so that sorting the same image again with other parameters
+    skips the stages whose inputs did not change. Entries are loaded memory-mapped, without copying. When the files
+    exceed max_bytes, the least recently used ones are deleted.
+
+    Several processes may share a cache directory: files are written under a temporary name and moved into place.
+    """
+
+    def __init__(self, directory: str, max_bytes: int = DEFAULTS["cache_limit"]):
+        """
+        :param directory: cache directory, created if needed
+        :param max_bytes: total size of the cached files to keep
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+
+    def array(
+        self, compute: typing.Callable[[], np.ndarray], stage: str, *key
+    ) -> np.ndarray:
+        """
+        The cached array for key, or the result of compute, which is then stored.
+        :param compute: computes the array on a cache miss
+        :param stage: name of the stage the array comes from, used as file name prefix
+        :param key: JSON serializable values the array depends on, e.g. an image digest and parameters
+        :return: read-only memory-mapped array on a hit, the computed array on a miss
+        """
+        path = self._path(stage, key)
+        try:
+            array = np.load(path, mmap_mode="r")
+        except (OSError, ValueError):
+            pass
+        else:
+            logging.debug(f"Loaded {stage} from {path}")
+            # The modification time orders entries for eviction.
+            os.utime(path)
+            return array
+        array = compute()
+        self._store(path, array)
+        return array
+
+    def _path(self, stage: str, key: tuple) -> str:
+        digest = hashlib.sha256(json.dumps(key).encode()).hexdigest()
+        return os.path.join(self.directory, f"{stage}-{digest}.npy")
+
+    def _store(self, path: str, array: np.ndarray):
+        temporary_path = f"{path}.{os.getpid()}.partial"
+        try:
+            with open(temporary_path, "wb") as fh:
+                np.save(fh, np.ascontiguousarray(array))
+            os.replace(temporary_path, path)
+        except OSError as e:
+            logging.warning(f"Could not write {path} to the cache: {e}")
+        finally:
+            if os.path.exists(temporary_path):
+                os.remove(temporary_path)
+        self._evict()
+
+    def _evict(self):
+        entries = []
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                if entry.name.endswith(".npy"):
+                    try:
+                        stat = entry.stat()
+                    except FileNotFoundError:
+                        continue
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+
+def image_digest(image: typing.Union[Image.Image, np.ndarray]) -> str:
+    """Hash of an image's size, mode and pixels, identifying it in cache keys."""
+    digest = hashlib.sha256()
+    if isinstance(image, Image.Image):
+        digest.update(f"{image.mode} {image.size}".encode())
+        digest.update(image.tobytes())
+    else:
+        digest.update(f"{image.dtype} {image.shape}".encode())
+        digest.update(np.ascontiguousarray(image).data)
+    return digest.hexdigest()
+
+
+def cached(
+    cache: typing.Optional[DiskCache],
+    compute: typing.Callable[[], np.ndarray],
+    stage: str,
+    *key,
+) -> np.ndarray:
+    """cache.array(compute, stage, *key), or just compute() without a cache."""
+    return compute() if cache is None else cache.array(compute, stage, *key)
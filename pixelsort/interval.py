@@ -1,121 +1,123 @@
 import typing
-from random import randint, random as random_range
 
 import numpy as np
-from PIL import ImageFilter
+from PIL import Image, ImageFilter
 
-from pixelsort.sorting import lightness, pixel_lightness
+from pixelsort.constants import INTERVAL_FUNCTIONS
+from pixelsort.interval_set import IntervalSet
+from pixelsort.sorting import lightness
 from pixelsort.super_pixel_image import SuperPixelImage
 
 
-def edge(
-    image: SuperPixelImage, lower_threshold: float, **_
-) -> typing.List[typing.List[int]]:
+def edge(image: SuperPixelImage, lower_threshold: float, **_) -> IntervalSet:
     """Performs an edge detection, which is used to define intervals. Tweak threshold with threshold."""
-    edge_data = image.scaled_image.filter(ImageFilter.FIND_EDGES).convert("RGBA").load()
-    intervals = []
-
-    for y in range(image.size[1]):
-        intervals.append([])
-        flag = True
-        for x in range(image.size[0]):
-            if pixel_lightness(edge_data[x, y]) < lower_threshold * 255:
-                flag = True
-            elif flag:
-                intervals[y].append(x)
-                flag = False
-    return intervals
+    level = image.keys(_edge_lightness)
+    return IntervalSet.from_starts(_run_starts(level >= lower_threshold * 510))
 
 
 def threshold(
     image: SuperPixelImage, lower_threshold: float, upper_threshold: float, **_
-) -> typing.List[typing.List[int]]:
+) -> IntervalSet:
     """Intervals defined by lightness thresholds; only pixels with a lightness between the upper and lower thresholds
     are sorted."""
-    level = lightness(image.average_colors)
-    boundaries = (level < lower_threshold * 255) | (level > upper_threshold * 255)
-    return [np.nonzero(row)[0] for row in boundaries]
+    # Lightness keys are doubled, so the thresholds are scaled to 0-510.
+    level = image.keys(lightness)
+    boundaries = (level < lower_threshold * 510) | (level > upper_threshold * 510)
+    return IntervalSet.from_starts(boundaries)
 
 
-def random(image: SuperPixelImage, char_length, **_) -> typing.List[typing.List[int]]:
+def random(
+    image: SuperPixelImage, char_length, rng: np.random.Generator, **_
+) -> IntervalSet:
     """Randomly generate intervals. Distribution of widths is linear by default. Interval widths can be scaled using
     char_length."""
-    intervals = []
-
-    for y in range(image.size[1]):
-        intervals.append([])
-        x = 0
-        while True:
-            x += int(char_length * random_range())
-            if x > image.size[0]:
-                break
-            else:
-                intervals[y].append(x)
-    return intervals
+    if char_length <= 1:
+        raise ValueError("char_length must be greater than 1 for random intervals")
+    return _random_walk(
+        image.size,
+        lambda shape: (char_length * rng.random(shape)).astype(np.intp),
+        mean_step=(char_length - 1) / 2,
+    )
+
+
+def waves(
+    image: SuperPixelImage, char_length, rng: np.random.Generator, **_
+) -> IntervalSet:
+    """Intervals are waves of nearly uniform widths. Control width of waves with char_length."""
+    if char_length + 5 <= 0:
+        raise ValueError("char_length must be greater than -5 for waves")
+    return _random_walk(
+        image.size,
+        lambda shape: char_length + rng.integers(0, 10, shape, endpoint=True),
+        mean_step=char_length + 5,
+    )
 
 
-def waves(image: SuperPixelImage, char_length, **_) -> typing.List[typing.List[int]]:
-    """Intervals are waves of nearly uniform widths. Control width of waves with char_length."""
-    intervals = []
-
-    for y in range(image.size[1]):
-        intervals.append([])
-        x = 0
-        while True:
-            x += char_length + randint(0, 10)
-            if x > image.size[0]:
-                break
-            else:
-                intervals[y].append(x)
-    return intervals
-
-
-def file_mask(
-    image: SuperPixelImage, interval_image, **_
-) -> typing.List[typing.List[int]]:
+def file_mask(image: SuperPixelImage, interval_image, **_) -> IntervalSet:
     """Intervals taken from another specified input image. Must be black and white, and the same size as the input
     image."""
-    intervals = []
-    data = interval_image.load()
-
-    for y in range(image.size[1]):
-        intervals.append([])
-        flag = True
-        for x in range(image.size[0]):
-            if data[x, y]:
-                flag = True
-            elif flag:
-                intervals[y].append(x)
-                flag = False
-    return intervals
+    width, height = image.size
+    data = np.asarray(interval_image)
+    if data.ndim == 3:
+        data = data.any(axis=2)
+    return IntervalSet.from_starts(_run_starts(data[:height, :width] == 0))
 
 
 def file_edges(
     image: SuperPixelImage, interval_image, lower_threshold, **_
-) -> typing.List[typing.List[int]]:
+) -> IntervalSet:
     """Intervals defined by performing edge detection on the file specified by -f. Must be the same size as the input
     image."""
-    edge_data = interval_image.filter(ImageFilter.FIND_EDGES).convert("RGBA").load()
-    intervals = []
-
-    for y in range(image.size[1]):
-        intervals.append([])
-        flag = True
-        for x in range(image.size[0]):
-            if pixel_lightness(edge_data[x, y]) < lower_threshold * 255:
-                flag = True
-            elif flag:
-                intervals[y].append(x)
-                flag = False
-    return intervals
-
-
-def none(image: SuperPixelImage, **_) -> typing.List[typing.List[int]]:
+    width, height = image.size
+    edge_data = np.asarray(
+        interval_image.filter(ImageFilter.FIND_EDGES).convert("RGBA")
+    )
+    return IntervalSet.from_starts(
+        _run_starts(lightness(edge_data[:height, :width]) >= lower_threshold * 510)
+    )
+
+
+def none(image: SuperPixelImage, **_) -> IntervalSet:
     """Sort whole rows, only stopping at image borders."""
-    intervals = []
-    for y in range(image.size[1]):
-        intervals.append([])
-    return intervals
+    return IntervalSet.empty(image.size[1])
+
+
+def _edge_lightness(average_colors: np.ndarray) -> np.ndarray:
+    """Lightness of the edge-detected image."""
+    edge_data = Image.fromarray(average_colors).filter(ImageFilter.FIND_EDGES)
+    return lightness(np.asarray(edge_data.convert("RGBA")))
+
+
+def _random_walk(
+    size: typing.Tuple[int, int],
+    steps: typing.Callable[[typing.Tuple[int, int]], np.ndarray],
+    mean_step: float,
+) -> IntervalSet:
+    """Boundaries at the running sums of random steps along every row, for as long as they stay within the row.
+    Steps for all rows are drawn together, in blocks of columns, until every row has run past its end. Raises
+    ValueError unless mean_step, the steps' expected value, is positive, as rows would never end otherwise.
+    """
+    if mean_step <= 0:
+        raise ValueError(f"random steps must advance, got a mean step of {mean_step}")
+    width, height = size
+    # Enough steps for nearly every row to finish within the first block
+    columns = 16 + 2 * int(width / max(mean_step, 1))
+    blocks, ends = [], np.zeros(height, dtype=np.intp)
+    while (ends <= width).any():
+        blocks.append(ends[:, None] + np.cumsum(steps((height, columns)), axis=1))
+        ends = blocks[-1][:, -1]
+    positions = np.concatenate(blocks, axis=1) if blocks else np.empty((height, 0))
+    inside = positions <= width
+    return IntervalSet(
+        positions[inside], np.concatenate(([0], np.cumsum(inside.sum(axis=1))))
+    )
+
+
+def _run_starts(on: np.ndarray) -> np.ndarray:
+    """True at the first pixel of every horizontal run of True values in on."""
+    starts = on.copy()
+    starts[:, 1:] &= ~on[:, :-1]
+    return starts
 
 
 interval_choices = {
@@ -127,3 +129,14 @@ interval_choices = {
     "file-edges": file_edges,
     "none": none,
 }
+# The CLI offers the names in constants, so it can do without importing this
+assert tuple(interval_choices) == INTERVAL_FUNCTIONS, "update INTERVAL_FUNCTIONS"
+
+# Interval functions whose result depends only on the image size and interval image, not on the pixels being sorted.
+STATIC_INTERVAL_FUNCTIONS = {"file", "file-edges", "none"}
+# Interval functions that only look at the super pixels within LOCAL_MARGIN of a boundary, so they give the same
+# boundaries on a crop of the grid with that margin. The others only look at the grid's size, so cropping them would
+# change their random draws, or at the whole interval image.
+LOCAL_INTERVAL_FUNCTIONS = {"threshold", "edges"}
+# Edge detection looks at the neighbours of every super pixel, and run starts at the one to their left.
+LOCAL_MARGIN = 2
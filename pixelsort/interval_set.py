@@ -0,0 +1,104 @@
+import typing
+
+import numpy as np
+
+
+class IntervalSet:
+    """Interval boundaries of every row of the super pixel grid in compressed
+    sparse row form: the boundaries of row y are
+    boundaries[offsets[y]:offsets[y + 1]], in non-decreasing order."""
+
+    def __init__(self, boundaries: np.ndarray, offsets: np.ndarray):
+        self.boundaries = np.asarray(boundaries, dtype=np.intp)
+        self.offsets = np.asarray(offsets, dtype=np.intp)
+
+    @classmethod
+    def from_rows(cls, rows: typing.Sequence[typing.Sequence[int]]) -> "IntervalSet":
+        """Builds an IntervalSet from one list of boundaries per row."""
+        if isinstance(rows, cls):
+            return rows
+        counts = np.fromiter((len(row) for row in rows), dtype=np.intp, count=len(rows))
+        boundaries = np.concatenate(
+            [np.asarray(row, dtype=np.intp) for row in rows] + [np.empty(0, np.intp)]
+        )
+        return cls(boundaries, np.concatenate(([0], np.cumsum(counts))))
+
+    @classmethod
+    def from_starts(cls, starts: np.ndarray) -> "IntervalSet":
+        """Builds an IntervalSet from a (height, width) boolean array that is True
+        wherever a new interval starts."""
+        rows, columns = np.nonzero(starts)
+        counts = np.bincount(rows, minlength=starts.shape[0])
+        return cls(columns, np.concatenate(([0], np.cumsum(counts))))
+
+    @classmethod
+    def empty(cls, height: int) -> "IntervalSet":
+        """An IntervalSet without any boundaries, i.e. whole rows."""
+        return cls(np.empty(0, np.intp), np.zeros(height + 1, np.intp))
+
+    @property
+    def counts(self) -> np.ndarray:
+        """Number of boundaries in each row."""
+        return np.diff(self.offsets)
+
+    @property
+    def rows(self) -> np.ndarray:
+        """Row index of every boundary."""
+        return np.repeat(np.arange(len(self)), self.counts)
+
+    def band(self, start: int, stop: int) -> "IntervalSet":
+        """The intervals of rows start to stop, as an IntervalSet of their own."""
+        offsets = self.offsets[start : stop + 1]
+        return IntervalSet(
+            self.boundaries[offsets[0] : offsets[-1]], offsets - offsets[0]
+        )
+
+    def columns(self, left: int, right: int) -> "IntervalSet":
+        """The boundaries between columns left and right, counted from left. Boundaries at or past right are dropped,
+        as they do not split the columns in between."""
+        keep = (self.boundaries >= left) & (self.boundaries < right)
+        counts = np.bincount(self.rows[keep], minlength=len(self))
+        return IntervalSet(
+            self.boundaries[keep] - left, np.concatenate(([0], np.cumsum(counts)))
+        )
+
+    def resized(
+        self, size: typing.Tuple[int, int], new_size: typing.Tuple[int, int]
+    ) -> "IntervalSet":
+        """The intervals of a grid of size (width, height) stretched over a grid of new_size: every new row takes the
+        boundaries of the old row it falls in, scaled by the ratio of the widths."""
+        width, height = size
+        new_width, new_height = new_size
+        source_rows = np.arange(new_height) * height // new_height
+        counts = self.counts[source_rows]
+        offsets = np.concatenate(([0], np.cumsum(counts)))
+        # Position of every new boundary in the old boundaries
+        index = np.repeat(self.offsets[source_rows] - offsets[:-1], counts) + np.arange(
+            offsets[-1]
+        )
+        return IntervalSet(self.boundaries[index] * new_width // width, offsets)
+
+    def __len__(self) -> int:
+        return self.offsets.size - 1
+
+    def __getitem__(self, y: int) -> np.ndarray:
+        return self.boundaries[self.offsets[y] : self.offsets[y + 1]]
+
+
+def changed_rows(
+    values: np.ndarray,
+    offsets: np.ndarray,
+    other_values: np.ndarray,
+    other_offsets: np.ndarray,
+) -> np.ndarray:
+    """Which rows differ between two arrays in compressed sparse row form, like the boundaries and offsets of two
+    IntervalSets, as a boolean array."""
+    counts = np.diff(offsets)
+    changed = counts != np.diff(other_offsets)
+    # Values of rows that have as many in both are compared in place
+    rows = np.repeat(np.arange(counts.size), counts)
+    compared = np.nonzero(~changed[rows])[0]
+    compared_rows = rows[compared]
+    other = other_offsets[compared_rows] + compared - offsets[compared_rows]
+    changed[compared_rows[values[compared] != other_values[other]]] = True
+    return changed
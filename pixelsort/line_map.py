@@ -0,0 +1,151 @@
+import collections
+import math
+import threading
+import typing
+
+import numpy as np
+
+
+class LineMap:
+    """Lays the pixels of an image out on a grid whose rows are parallel sort lines at an angle, like the image
+    rotated counterclockwise by that angle. The rotation is done with three integer shears, which map pixels to grid
+    slots one to one, so gathering onto the grid and scattering back loses nothing and needs no
+    resampling."""
+
+    def __init__(self, size: typing.Tuple[int, int], angle: float):
+        width, height = size
+        self.size = size
+        self.angle = angle
+
+        # Whole quarter turns are exact; only the remainder in [-45, 45] is sheared.
+        quarter_turns = round(angle / 90)
+        residual = math.radians(angle - 90 * quarter_turns)
+        pixels = np.rot90(
+            np.arange(width * height, dtype=_index_type(width * height)).reshape(
+                height, width
+            ),
+            quarter_turns % 4,
+        )
+        rows, cols = pixels.shape
+        # Paeth's rotation: each shear moves whole rows or columns by an integer
+        # amount, so their composition is a bijection on the integer lattice.
+        shear_x, shear_y = math.tan(residual / 2), math.sin(residual)
+
+        def slots(start: int, stop: int) -> typing.Tuple[np.ndarray, np.ndarray]:
+            """Unshifted grid (y, x) of the pixels in rows start to stop of pixels."""
+            y, x = np.mgrid[start:stop, 0:cols]
+            y -= rows // 2
+            x -= cols // 2
+            x = x + _round(shear_x * y)
+            y = y - _round(shear_y * x)
+            x = x + _round(shear_x * y)
+            return y, x
+
+        # Slots are computed a band of rows at a time, once for the grid's
+        # extent and once to fill it in, so no temporary array is the size of
+        # the image.
+        band_rows = max(_BAND_PIXELS // cols, 1)
+        bands = [
+            (start, min(start + band_rows, rows)) for start in range(0, rows, band_rows)
+        ]
+        top = left = np.iinfo(np.intp).max
+        bottom = right = np.iinfo(np.intp).min
+        for start, stop in bands:
+            y, x = slots(start, stop)
+            top, bottom = min(top, y.min()), max(bottom, y.max())
+            left, right = min(left, x.min()), max(right, x.max())
+        shape = (bottom - top + 1, right - left + 1)
+        # Half the size of intp for all but huge images, which matters as maps
+        # are cached
+        dtype = _index_type(shape[0] * shape[1])
+
+        #: (rows, cols) flat source pixel index of every grid slot, -1 for slots outside the image.
+        self.index = np.full(shape, -1, dtype=dtype)
+        #: Flat grid slot of every source pixel, in row-major source order.
+        self.inverse = np.empty(width * height, dtype=dtype)
+        for start, stop in bands:
+            y, x = slots(start, stop)
+            slot = (y - top) * shape[1] + (x - left)
+            self.index.reshape(-1)[slot] = pixels[start:stop]
+            self.inverse[pixels[start:stop]] = slot
+
+    @property
+    def nbytes(self) -> int:
+        """Memory taken by the map's arrays."""
+        return self.index.nbytes + self.inverse.nbytes
+
+    @property
+    def grid_size(self) -> typing.Tuple[int, int]:
+        """Size of the line grid as (width, height)."""
+        return self.index.shape[1], self.index.shape[0]
+
+    def gather(
+        self,
+        pixels: np.ndarray,
+        box: typing.Optional[typing.Tuple[int, int, int, int]] = None,
+    ) -> np.ndarray:
+        """Lays an (height, width, ...) array out on the line grid, or only the slots in box (left, top, right,
+        bottom). Slots outside the image are zero."""
+        index = self.index
+        if box is not None:
+            left, top, right, bottom = box
+            index = index[top:bottom, left:right]
+        grid = pixels.reshape((-1,) + pixels.shape[2:])[index]
+        # A where= mask, unlike boolean indexing, builds no index arrays
+        outside = (index < 0).reshape(index.shape + (1,) * (grid.ndim - 2))
+        np.copyto(grid, 0, where=outside)
+        return grid
+
+    def scatter(
+        self, grid: np.ndarray, out: typing.Optional[np.ndarray] = None
+    ) -> np.ndarray:
+        """Inverse of gather: puts every pixel of a line grid array back at its place in the image, in out if given."""
+        width, height = self.size
+        shape = (height, width) + grid.shape[2:]
+        if out is None:
+            out = np.empty(shape, dtype=grid.dtype)
+        flat = grid.reshape((-1,) + grid.shape[2:])
+        if out.flags.c_contiguous:
+            np.take(flat, self.inverse, axis=0, out=out.reshape((-1,) + grid.shape[2:]))
+        else:
+            out[...] = flat[self.inverse].reshape(shape)
+        return out
+
+
+# Pixels per band of rows worked on at once while building a LineMap
+_BAND_PIXELS = 2**16
+# Bytes of LineMaps line_map keeps. A diagonal map of a 24 megapixel image
+# takes about 300 MB, so this holds a few maps of typical images without
+# growing with every angle a long running server sees.
+CACHE_BYTES = 256 * 2**20
+_cache: "collections.OrderedDict[tuple, LineMap]" = collections.OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def line_map(size: typing.Tuple[int, int], angle: float) -> LineMap:
+    """LineMap for the given image size and angle, cached since renders often repeat them. The least recently used
+    maps are dropped once the cache exceeds CACHE_BYTES, but the latest one is always kept.
+    """
+    key = (tuple(size), angle)
+    with _cache_lock:
+        if key in _cache:
+            _cache.move_to_end(key)
+            return _cache[key]
+    # Built outside the lock, so threads needing other maps do not wait
+    result = LineMap(size, angle)
+    with _cache_lock:
+        _cache[key] = result
+        _cache.move_to_end(key)
+        cached = sum(cached_map.nbytes for cached_map in _cache.values())
+        while cached > CACHE_BYTES and len(_cache) > 1:
+            cached -= _cache.popitem(last=False)[1].nbytes
+    return result
+
+
+def _index_type(count: int) -> type:
+    """The smallest integer type of intp and int32 holding indices up to count."""
+    return np.int32 if count < 2**31 else np.intp
+
+
+def _round(values: np.ndarray) -> np.ndarray:
+    return np.floor(values + 0.5).astype(np.intp)
@@ -1,3 +1,4 @@
+import copy
 import logging
 import typing
 
@@ -5,12 +6,31 @@ import numpy as np
 from PIL import Image
 
 from pixelsort.constants import DEFAULTS
-from pixelsort.interval import interval_choices
+from pixelsort.disk_cache import DiskCache, cached, image_digest
+from pixelsort.interval import (
+    LOCAL_INTERVAL_FUNCTIONS,
+    LOCAL_MARGIN,
+    STATIC_INTERVAL_FUNCTIONS,
+    interval_choices,
+)
+from pixelsort.interval_set import IntervalSet
 from pixelsort.sorting import sort_image
 from pixelsort.sorting import sorting_choices
-from pixelsort.util import crop_to
+from pixelsort.line_map import line_map
+from pixelsort.parallel import map_row_bands, row_bands
+from pixelsort.profiling import Profile, stage
 from pixelsort.super_pixel_image import SuperPixelImage
 
+# Temporary bytes per super pixel of sorting a band of rows: interval ids,
+# argsort orders and their gathers, mostly 64 bit.
+_SORT_BYTES_PER_SUPER_PIXEL = 64
+# Temporary bytes per pixel of placing a band of rows: the gathered pixels and
+# their source columns.
+_PLACE_BYTES_PER_PIXEL = 12
+# Temporary bytes per pixel of gathering a band of rows onto the line grid and
+# scattering it back: the pixels, their mask and their 64 bit source indices.
+_LINE_BYTES_PER_PIXEL = 40
+
 
 def pixelsort(
     image: Image.Image,
@@ -28,6 +48,12 @@ def pixelsort(
     upper_threshold: float = DEFAULTS["upper_threshold"],
     angle: float = DEFAULTS["angle"],
     super_pixel_size: int = DEFAULTS["super_pixel_size"],
+    seed: typing.Union[int, np.random.Generator, None] = None,
+    workers: int = 1,
+    cache: typing.Optional[DiskCache] = None,
+    memory_budget: typing.Optional[int] = None,
+    profile: typing.Optional[Profile] = None,
+    cancel_check: typing.Optional[typing.Callable[[], None]] = None,
 ) -> Image.Image:
     """
     pixelsorts an image
@@ -44,93 +70,858 @@ def pixelsort(
         0-1. Used in threshold mode.
     :param angle: Angle at which you're pixel sorting in degrees.
     :param super_pixel_size: Size of super pixels to sort. Defaults to 1 (single pixel).
+    :param seed: Seed for random intervals and randomness, or a numpy Generator to draw from. The same seed gives the
+        same output. Unseeded by default.
+    :param workers: Number of threads sorting bands of rows at the same time. The output is the same for any number.
+    :param cache: DiskCache keeping the rotated image, super pixels, sort keys and static intervals across runs.
+    :param memory_budget: Approximate number of bytes for the temporary arrays of sorting and placing pixels, which
+        are then worked on in bands of rows. Arrays the size of the image, like the result, and the map of the sort
+        lines at angles other than right ones come on top. Unbounded by default.
+    :param profile: Profile to record the time and memory used by each stage in.
+    :param cancel_check: Called between stages; raising from it stops the render, e.g. once it is no longer needed.
     :return: pixelsorted image
     """
-    original = image
-    image = image.convert("RGBA").rotate(angle, expand=True)
-
-    logging.debug("Converting to SuperPixelImage...")
-    super_pixel_image = SuperPixelImage(image=image, super_pixel_size=super_pixel_size)
-
-    logging.debug("Loading Mask...")
-    mask_image = mask_image if mask_image else Image.new("1", original.size, color=255)
-    mask_image = mask_image.convert("L").rotate(angle, expand=True, fillcolor=0)
-    mask_data = _mask_array(mask_image, super_pixel_image)
-
-    logging.debug("Loading Interval Image...")
-    if interval_image:
-        threshold = 200
-        fn = lambda x: 255 if x > threshold else 0
-        interval_image = interval_image.convert("L").rotate(angle, expand=True)
-        if super_pixel_size > 1:
-            interval_image = interval_image.reduce(super_pixel_size)
-        interval_image = interval_image.point(fn, mode="1")
+    return Image.fromarray(
+        pixelsort_array(
+            image,
+            mask_image=mask_image,
+            interval_image=interval_image,
+            randomness=randomness,
+            char_length=char_length,
+            sorting_function=sorting_function,
+            interval_function=interval_function,
+            lower_threshold=lower_threshold,
+            upper_threshold=upper_threshold,
+            angle=angle,
+            super_pixel_size=super_pixel_size,
+            seed=seed,
+            workers=workers,
+            cache=cache,
+            memory_budget=memory_budget,
+            profile=profile,
+            cancel_check=cancel_check,
+        ),
+        "RGBA",
+    )
 
-    logging.debug("Determining intervals...")
-    intervals = interval_choices[interval_function](
-        super_pixel_image,
+
+def pixelsort_array(
+    image: np.ndarray,
+    out: typing.Optional[np.ndarray] = None,
+    mask_image: typing.Union[np.ndarray, Image.Image, None] = None,
+    interval_image: typing.Union[np.ndarray, Image.Image, None] = None,
+    randomness: float = DEFAULTS["randomness"],
+    char_length: float = DEFAULTS["char_length"],
+    sorting_function: typing.Literal[
+        "lightness", "hue", "saturation", "intensity", "minimum"
+    ] = DEFAULTS["sorting_function"],
+    interval_function: typing.Literal[
+        "random", "threshold", "edges", "waves", "file", "file-edges", "none"
+    ] = DEFAULTS["interval_function"],
+    lower_threshold: float = DEFAULTS["lower_threshold"],
+    upper_threshold: float = DEFAULTS["upper_threshold"],
+    angle: float = DEFAULTS["angle"],
+    super_pixel_size: int = DEFAULTS["super_pixel_size"],
+    seed: typing.Union[int, np.random.Generator, None] = None,
+    workers: int = 1,
+    cache: typing.Optional[DiskCache] = None,
+    memory_budget: typing.Optional[int] = None,
+    profile: typing.Optional[Profile] = None,
+    cancel_check: typing.Optional[typing.Callable[[], None]] = None,
+) -> np.ndarray:
+    """
+    pixelsorts an image held in a NumPy array, e.g. a frame from a video decoder. RGBA arrays are read in place,
+    through views where the angle allows it, and RGB arrays are copied once to add an alpha channel.
+    :param image: (height, width, 3|4) uint8 array of RGB or RGBA pixels to pixelsort, a (height, width) grayscale
+        array or a PIL image
+    :param out: (height, width, 4) uint8 array to write the RGBA result to. Allocated if not given.
+    :param mask_image: Mask used for masking parts of the image, as a (height, width) array or an image. Nonzero pixels
+        are sorted.
+    :param interval_image: Image used to define intervals, as a (height, width) array or an image. Must be black and
+        white.
+    :param randomness: What percentage of intervals *not* to sort. 0 by default.
+    :param char_length:	Characteristic length for the random width generator. Used in mode `random` and `waves`.
+    :param sorting_function: Sorting function to use for sorting the pixels.
+    :param interval_function: Controls how the intervals used for sorting are defined.
+    :param lower_threshold: How dark must a pixel be to be considered as a 'border' for sorting? Takes values from 0-1.
+        Used in edges and threshold modes.
+    :param upper_threshold: How bright must a pixel be to be considered as a 'border' for sorting? Takes values from
+        0-1. Used in threshold mode.
+    :param angle: Angle at which you're pixel sorting in degrees.
+    :param super_pixel_size: Size of super pixels to sort. Defaults to 1 (single pixel).
+    :param seed: Seed for random intervals and randomness, or a numpy Generator to draw from. The same seed gives the
+        same output. Unseeded by default.
+    :param workers: Number of threads sorting bands of rows at the same time. The output is the same for any number.
+    :param cache: DiskCache keeping the rotated image, super pixels, sort keys and static intervals across runs.
+    :param memory_budget: Approximate number of bytes for the temporary arrays of sorting and placing pixels, which
+        are then worked on in bands of rows. Arrays the size of the image, like the result, and the map of the sort
+        lines at angles other than right ones come on top. Unbounded by default.
+    :param profile: Profile to record the time and memory used by each stage in.
+    :param cancel_check: Called between stages; raising from it stops the render, e.g. once it is no longer needed.
+    :return: out, holding the pixelsorted image
+    """
+    setup = SortSetup(
+        _size(image),
+        mask_image=mask_image,
+        interval_image=interval_image,
+        char_length=char_length,
+        interval_function=interval_function,
         lower_threshold=lower_threshold,
         upper_threshold=upper_threshold,
-        char_length=char_length,
-        interval_image=interval_image,
+        angle=angle,
+        super_pixel_size=super_pixel_size,
+        seed=seed,
+        workers=workers,
+        cache=cache,
+        memory_budget=memory_budget,
+        profile=profile,
+        cancel_check=cancel_check,
     )
-    logging.debug("Sorting pixels...")
-    perm = sort_image(
-        super_pixel_image.size,
-        super_pixel_image,
-        mask_data,
-        intervals,
-        randomness,
-        sorting_choices[sorting_function],
+    return sort_array(image, setup, randomness, sorting_function, out=out)
+
+
+class SortSetup:
+    """The part of a pixelsort run that does not depend on the image's pixels: the mask grid, the prepared interval
+    image and, for interval functions that only look at the interval image, the intervals themselves. It is built
+    once and shared by every image of the same size, e.g. the frames of an animation."""
+
+    def __init__(
+        self,
+        size: typing.Tuple[int, int],
+        mask_image: typing.Optional[Image.Image] = None,
+        interval_image: typing.Optional[Image.Image] = None,
+        char_length: float = DEFAULTS["char_length"],
+        interval_function: str = DEFAULTS["interval_function"],
+        lower_threshold: float = DEFAULTS["lower_threshold"],
+        upper_threshold: float = DEFAULTS["upper_threshold"],
+        angle: float = DEFAULTS["angle"],
+        super_pixel_size: int = DEFAULTS["super_pixel_size"],
+        seed: typing.Union[int, np.random.Generator, None] = None,
+        workers: int = 1,
+        cache: typing.Optional[DiskCache] = None,
+        memory_budget: typing.Optional[int] = None,
+        profile: typing.Optional[Profile] = None,
+        cancel_check: typing.Optional[typing.Callable[[], None]] = None,
+    ):
+        self.size = size
+        # Every image sorted with this setup draws from a fresh generator
+        # seeded with it, so its output does not depend on the images before.
+        self.seed = seed
+        self.workers = workers
+        self.cache = cache
+        self.memory_budget = memory_budget
+        self.profile = profile
+        self.cancel_check = cancel_check
+        self.angle = angle
+        # Right angles are sorted on rotated views of the pixel arrays, other
+        # angles on a line grid gathered through a cached LineMap.
+        self.quarter_turns = int(angle // 90) % 4 if angle % 90 == 0 else None
+        self.line_map = line_map(size, angle) if self.quarter_turns is None else None
+        # Within a memory budget the image is sorted a band of rows of the grid
+        # at a time, and the mask only rotated band by band, see mask_rows.
+        self._banded = memory_budget is not None
+        self.super_pixel_size = super_pixel_size
+        self.interval_function = interval_function
+        self.interval_options = {
+            "lower_threshold": lower_threshold,
+            "upper_threshold": upper_threshold,
+            "char_length": char_length,
+        }
+
+        if isinstance(mask_image, np.ndarray):
+            mask_image = Image.fromarray(mask_image)
+        if isinstance(interval_image, np.ndarray):
+            interval_image = Image.fromarray(interval_image)
+
+        self.check_cancelled()
+        logging.debug("Loading Mask...")
+        # The mask's pixels, unrotated, when it is rotated by mask_rows
+        self._mask_pixels = None
+        with stage(profile, "mask"):
+            if mask_image is None and self.line_map is None:
+                # Right angles leave no uncovered area, so everything is
+                # sortable and mask_data needs no full-size mask.
+                self.mask_image = None
+            elif self._banded:
+                self.mask_image = None
+                if mask_image is not None and self.line_map is None:
+                    # Rotated like _rotate does, keeping the mask's own size
+                    self._mask_pixels = np.rot90(
+                        np.asarray(mask_image.convert("L")), self.quarter_turns
+                    )
+                elif mask_image is not None:
+                    self._mask_pixels = self._fit(mask_image.convert("L"))
+            else:
+                if mask_image is None:
+                    mask_image = Image.new("1", size, color=255)
+                self.mask_image = self._rotate(mask_image.convert("L"))
+
+        self.check_cancelled()
+        logging.debug("Loading Interval Image...")
+        with stage(profile, "interval_image"):
+            if interval_image:
+                threshold = 200
+                fn = lambda x: 255 if x > threshold else 0
+                interval_image = self._rotate(interval_image.convert("L"))
+                if super_pixel_size > 1:
+                    interval_image = interval_image.reduce(super_pixel_size)
+                interval_image = interval_image.point(fn, mode="1")
+            self.interval_image = interval_image
+        self._interval_digest = (
+            image_digest(interval_image) if cache and interval_image else None
+        )
+
+        self._mask_data = None
+        self._mask_box = None
+        self._intervals = None
+
+    def check_cancelled(self):
+        """Calls cancel_check, if given, which raises to stop the run between two of its stages."""
+        if self.cancel_check is not None:
+            self.cancel_check()
+
+    def _rotate(self, image: Image.Image) -> Image.Image:
+        """Rotates a single channel image like the pixels being sorted, filling uncovered areas with 0."""
+        if self.line_map is None:
+            return image.rotate(self.angle, expand=True, fillcolor=0)
+        return Image.fromarray(self.line_map.gather(self._fit(image)))
+
+    def _fit(self, image: Image.Image) -> np.ndarray:
+        """A single channel image's pixels, cropped or padded with 0 to the size of the images sorted."""
+        width, height = self.size
+        data = np.zeros((height, width), dtype=np.uint8)
+        source = np.asarray(image)[:height, :width]
+        data[: source.shape[0], : source.shape[1]] = source
+        return data
+
+    def with_intervals(
+        self,
+        interval_function: str = DEFAULTS["interval_function"],
+        lower_threshold: float = DEFAULTS["lower_threshold"],
+        upper_threshold: float = DEFAULTS["upper_threshold"],
+        char_length: float = DEFAULTS["char_length"],
+        intervals: typing.Optional[IntervalSet] = None,
+    ) -> "SortSetup":
+        """A copy of this setup with different interval parameters, sharing its mask and interval image. Given
+        intervals, e.g. ones scaled up from a preview, are used for every image instead of determining them.
+        """
+        setup = copy.copy(self)
+        setup.interval_function = interval_function
+        setup.interval_options = {
+            "lower_threshold": lower_threshold,
+            "upper_threshold": upper_threshold,
+            "char_length": char_length,
+        }
+        setup._intervals = intervals
+        return setup
+
+    @property
+    def grid_size(self) -> typing.Tuple[int, int]:
+        """Size of the super pixel grid as (width, height), counting blocks cut off by the edge."""
+        if self.line_map is not None:
+            width, height = self.line_map.grid_size
+        elif self.quarter_turns % 2:
+            height, width = self.size
+        else:
+            width, height = self.size
+        block = self.super_pixel_size
+        return -(-width // block), -(-height // block)
+
+    def prepare(
+        self,
+        image: typing.Union[Image.Image, np.ndarray],
+        box: typing.Optional[typing.Tuple[int, int, int, int]] = None,
+    ) -> SuperPixelImage:
+        """Rotates image, a PIL image or an RGB(A) array, and reduces it to super pixels, ready to be sorted with this
+        setup. Given a box (left, top, right, bottom) of the super pixel grid, e.g. its region(), only the super pixels
+        in it are prepared."""
+        if _size(image) != self.size:
+            raise ValueError(
+                f"expected an image of size {self.size}, got {_size(image)}"
+            )
+        self.check_cancelled()
+        if box is not None and self.cache:
+            # The cache holds whole images
+            return self.prepare(image).crop(box)
+        cache_key = (image_digest(image), self.angle) if self.cache else ()
+
+        def rotate() -> np.ndarray:
+            if box is not None:
+                left, top, right, bottom = (
+                    side * self.super_pixel_size for side in box
+                )
+            if self.line_map is not None:
+                return self.line_map.gather(
+                    rgba_pixels(image),
+                    None if box is None else (left, top, right, bottom),
+                )
+            # Arrays are cropped before they are converted, so only the box of
+            # a memory-mapped one is read.
+            pixels = image if isinstance(image, np.ndarray) else rgba_pixels(image)
+            pixels = np.rot90(pixels, self.quarter_turns)
+            return rgba_pixels(
+                pixels if box is None else pixels[top:bottom, left:right]
+            )
+
+        with stage(self.profile, "convert/rotate"):
+            pixels = cached(self.cache, rotate, "rotated", *cache_key)
+
+        self.check_cancelled()
+        logging.debug("Converting to SuperPixelImage...")
+        with stage(self.profile, "super_pixel_image"):
+            super_pixel_image = SuperPixelImage(
+                image=pixels,
+                super_pixel_size=self.super_pixel_size,
+                cache=self.cache,
+                cache_key=cache_key,
+            )
+        if not self._banded:
+            self.mask_data()
+        return super_pixel_image
+
+    def mask_data(self) -> np.ndarray:
+        """The mask on the super pixel grid, see _mask_array."""
+        if self._mask_data is None:
+            with stage(self.profile, "mask"):
+                if self._banded:
+                    self._mask_data = self._rotate_mask_rows(0, self.grid_size[1])
+                elif self.mask_image is None:
+                    cols, rows = self.grid_size
+                    self._mask_data = np.broadcast_to(True, (rows, cols))
+                else:
+                    self._mask_data = _mask_array(
+                        self.mask_image, self.super_pixel_size, self.grid_size
+                    )
+        return self._mask_data
+
+    def mask_rows(self, start: int, stop: int) -> np.ndarray:
+        """Rows start to stop of mask_data(). Within a memory budget, only the mask's pixels in those rows are
+        rotated."""
+        if not self._banded or self._mask_data is not None:
+            return self.mask_data()[start:stop]
+        with stage(self.profile, "mask"):
+            return self._rotate_mask_rows(start, stop)
+
+    def _rotate_mask_rows(self, start: int, stop: int) -> np.ndarray:
+        block = self.super_pixel_size
+        cols = self.grid_size[0]
+        if self.line_map is None:
+            if self._mask_pixels is None:
+                return np.ones((stop - start, cols), dtype=bool)
+            strip = self._mask_pixels[start * block : stop * block]
+            if strip.size == 0:
+                # Past the end of a mask smaller than the image
+                return np.zeros((stop - start, cols), dtype=bool)
+            return _mask_array(
+                Image.fromarray(np.ascontiguousarray(strip)),
+                block,
+                (cols, stop - start),
+            )
+        index = self.line_map.index[start * block : stop * block]
+        if self._mask_pixels is None:
+            strip = np.where(index >= 0, 255, 0).astype(np.uint8)
+        else:
+            strip = np.where(
+                index >= 0, self._mask_pixels.reshape(-1)[index], 0
+            ).astype(np.uint8)
+        return _mask_array(Image.fromarray(strip), block, (cols, stop - start))
+
+    def region(
+        self, randomness: float = DEFAULTS["randomness"]
+    ) -> typing.Optional[typing.Tuple[int, int, int, int]]:
+        """
+        The box (left, top, right, bottom) of the super pixel grid that sorting with this setup changes: every masked
+        super pixel and the margin local interval functions look at. Sorting only this box gives the same result as
+        sorting the whole grid. With randomness, whole rows are kept, as the intervals left unsorted are drawn for
+        every row with masked super pixels. Within a memory budget, bands of rows without masked super pixels are
+        skipped instead.
+        :return: the box, or None if it is the whole grid
+        """
+        if self.mask_image is None:
+            return None
+        cols, rows = self.grid_size
+        if self._mask_box is None:
+            mask_data = self.mask_data()
+            masked_rows = np.flatnonzero(mask_data.any(axis=1))
+            masked_cols = np.flatnonzero(mask_data.any(axis=0))
+            if masked_rows.size == 0:
+                self._mask_box = (0, 0, cols, rows)
+            else:
+                self._mask_box = (
+                    max(masked_cols[0] - LOCAL_MARGIN, 0),
+                    max(masked_rows[0] - LOCAL_MARGIN, 0),
+                    min(masked_cols[-1] + 1 + LOCAL_MARGIN, cols),
+                    min(masked_rows[-1] + 1 + LOCAL_MARGIN, rows),
+                )
+        left, top, right, bottom = self._mask_box
+        if randomness > 0:
+            left, right = 0, cols
+        if (left, top, right, bottom) == (0, 0, cols, rows):
+            return None
+        return int(left), int(top), int(right), int(bottom)
+
+    def band_height(self, super_pixel_image: SuperPixelImage) -> typing.Optional[int]:
+        """Rows of the super pixel grid to sort and place at a time within the memory budget, None without one."""
+        if self.memory_budget is None:
+            return None
+        return self._band_rows(super_pixel_image.size[0], _PLACE_BYTES_PER_PIXEL)
+
+    def _band_rows(self, cols: int, pixel_bytes: int) -> int:
+        """Rows of cols super pixels that fit the memory budget, taking pixel_bytes per pixel on top of sorting."""
+        block = self.super_pixel_size
+        row_bytes = cols * (_SORT_BYTES_PER_SUPER_PIXEL + block * block * pixel_bytes)
+        return max(self.memory_budget // row_bytes, 1)
+
+    def intervals(
+        self,
+        super_pixel_image: SuperPixelImage,
+        rng: typing.Optional[np.random.Generator] = None,
+        box: typing.Optional[typing.Tuple[int, int, int, int]] = None,
+    ) -> IntervalSet:
+        """Intervals of the super pixel image, reused across images when they do not depend on its pixels. Random
+        intervals are drawn from rng, a generator seeded with the setup's seed by default. Given the box of the grid
+        super_pixel_image was cropped to, given intervals and those that do not only depend on nearby super pixels
+        are determined for the whole grid and cropped, so they are the same as without a box.
+        """
+        if box is not None and (
+            self._intervals is not None
+            or self.interval_function not in LOCAL_INTERVAL_FUNCTIONS
+        ):
+            left, top, right, bottom = box
+            # Only the grid's size is looked at
+            intervals = IntervalSet.from_rows(
+                self.intervals(_Grid(self.grid_size), rng)
+            ).band(top, bottom)
+            if (left, right) == (0, self.grid_size[0]):
+                return intervals
+            return intervals.columns(left, right)
+        if self._intervals is not None:
+            return self._intervals
+
+        def determine() -> IntervalSet:
+            return interval_choices[self.interval_function](
+                super_pixel_image,
+                interval_image=self.interval_image,
+                rng=rng if rng is not None else np.random.default_rng(self.seed),
+                **self.interval_options,
+            )
+
+        with stage(self.profile, "intervals"):
+            if self.interval_function not in STATIC_INTERVAL_FUNCTIONS:
+                return determine()
+            if self.cache is None:
+                self._intervals = determine()
+            else:
+                # Static intervals only depend on the interval image, so they
+                # are cached under its digest. Stored as offsets then boundaries.
+                packed = self.cache.array(
+                    lambda: _pack(determine()),
+                    "intervals",
+                    self._interval_digest,
+                    self.interval_function,
+                    self.interval_options,
+                    super_pixel_image.size,
+                )
+                height = super_pixel_image.size[1]
+                self._intervals = IntervalSet(
+                    packed[height + 1 :], packed[: height + 1]
+                )
+        return self._intervals
+
+
+class _Grid(typing.NamedTuple):
+    """Stands in for the SuperPixelImage of a whole grid for interval functions that only look at its size."""
+
+    size: typing.Tuple[int, int]
+
+
+def sort_frame(
+    image: Image.Image,
+    setup: SortSetup,
+    randomness: float = DEFAULTS["randomness"],
+    sorting_function: str = DEFAULTS["sorting_function"],
+    super_pixel_image: typing.Optional[SuperPixelImage] = None,
+) -> Image.Image:
+    """
+    pixelsorts one image using precomputed static work
+    :param image: image to pixelsort, the size the setup was built for
+    :param setup: SortSetup holding the mask, interval image and interval parameters
+    :param randomness: What percentage of intervals *not* to sort. 0 by default.
+    :param sorting_function: Sorting function to use for sorting the pixels.
+    :param super_pixel_image: image as returned by setup.prepare(), to reuse it and its cached sort keys across calls
+    :return: pixelsorted image
+    """
+    return Image.fromarray(
+        sort_array(image, setup, randomness, sorting_function, super_pixel_image),
+        "RGBA",
     )
 
+
+def sort_array(
+    image: typing.Union[Image.Image, np.ndarray],
+    setup: SortSetup,
+    randomness: float = DEFAULTS["randomness"],
+    sorting_function: str = DEFAULTS["sorting_function"],
+    super_pixel_image: typing.Optional[SuperPixelImage] = None,
+    out: typing.Optional[np.ndarray] = None,
+) -> np.ndarray:
+    """
+    sort_frame for arrays: pixelsorts one RGB(A) array or image using precomputed static work
+    :param image: (height, width, 3|4) uint8 array or image to pixelsort, the size the setup was built for
+    :param setup: SortSetup holding the mask, interval image and interval parameters
+    :param randomness: What percentage of intervals *not* to sort. 0 by default.
+    :param sorting_function: Sorting function to use for sorting the pixels.
+    :param super_pixel_image: image as returned by setup.prepare(), to reuse it and its cached sort keys across calls
+    :param out: (height, width, 4) uint8 array to write the RGBA result to. Allocated if not given.
+    :return: out, holding the pixelsorted image
+    """
+    width, height = setup.size
+    if out is None:
+        out = np.empty((height, width, 4), dtype=np.uint8)
+    elif out.shape != (height, width, 4) or out.dtype != np.uint8:
+        raise ValueError(
+            f"out must be a ({height}, {width}, 4) uint8 array, got {out.shape} {out.dtype}"
+        )
+    if setup._banded and super_pixel_image is None and not setup.cache:
+        return _sort_line_bands(image, setup, randomness, sorting_function, out)
+    # Only the part of the grid the mask reaches is sorted, the rest of the
+    # image stays as it is.
+    box = setup.region(randomness)
+    mask_data = setup.mask_data()
+    if super_pixel_image is None:
+        super_pixel_image = setup.prepare(image, box)
+    elif box is not None:
+        super_pixel_image = super_pixel_image.crop(box)
+    if box is not None:
+        left, top, right, bottom = box
+        mask_data = mask_data[top:bottom, left:right]
+
+    band_height = setup.band_height(super_pixel_image)
+    rng = np.random.default_rng(setup.seed)
+    setup.check_cancelled()
+    logging.debug("Determining intervals...")
+    intervals = setup.intervals(super_pixel_image, rng, box)
+    setup.check_cancelled()
+    logging.debug("Sorting pixels...")
+    with stage(setup.profile, "keys"):
+        # Cached on the image, so sort_image below reuses them
+        super_pixel_image.keys(sorting_choices[sorting_function])
+    setup.check_cancelled()
+    with stage(setup.profile, "sort_image"):
+        perm = sort_image(
+            super_pixel_image.size,
+            super_pixel_image,
+            mask_data,
+            intervals,
+            randomness,
+            sorting_choices[sorting_function],
+            rng,
+            setup.workers,
+            band_height,
+        )
+
+    setup.check_cancelled()
     logging.debug("Processing sorted pixels...")
-    output_img = _place_blocks(perm, super_pixel_image)
-    if angle != 0:
-        output_img = output_img.rotate(-angle, expand=True)
-        output_img = crop_to(output_img, original)
+    # out is written before the original is read again for compositing, so
+    # it may only be written directly when it is not the image itself.
+    overlaps = isinstance(image, np.ndarray) and np.may_share_memory(out, image)
+    if box is not None:
+        with stage(setup.profile, "place_blocks"):
+            output = _place_blocks(
+                perm, super_pixel_image, setup.workers, band_height=band_height
+            )
+        original = rgba_pixels(image)
+        opaque = output[..., 3].min() == 255 and original[..., 3].min() == 255
+        result = out if opaque or not overlaps else np.empty_like(out)
+        with stage(setup.profile, "unrotate"):
+            if not (overlaps and result is out):
+                # Outside the box, the sorted image is the original
+                result[...] = original
+            _paste_region(output, box, setup, result)
+        del output
+    elif setup.line_map is None and not overlaps:
+        with stage(setup.profile, "place_blocks"):
+            # Placed through a rotated view of out, which unrotates for free
+            _place_blocks(
+                perm,
+                super_pixel_image,
+                setup.workers,
+                out=np.rot90(out, setup.quarter_turns),
+                band_height=band_height,
+            )
+        result = out
+        opaque = out[..., 3].min() == 255
+    else:
+        with stage(setup.profile, "place_blocks"):
+            output = _place_blocks(
+                perm, super_pixel_image, setup.workers, band_height=band_height
+            )
+        # Nothing shows through an opaque result, so compositing is a no-op
+        opaque = output[..., 3].min() == 255
+        # Otherwise the original is still needed
+        result = out if opaque or not overlaps else np.empty_like(out)
+        with stage(setup.profile, "unrotate"):
+            if setup.line_map is None:
+                result[...] = np.rot90(output, -setup.quarter_turns)
+            else:
+                setup.line_map.scatter(output, out=result)
+        del output
+    del perm
+    if opaque:
+        logging.debug("Done...")
+        return out
 
-    final_image = original.convert("RGBA")
+    setup.check_cancelled()
+    with stage(setup.profile, "composite"):
+        _composite(
+            rgba_pixels(image),
+            result,
+            out,
+            band_height * super_pixel_image.super_pixel_size if band_height else None,
+        )
 
-    # Squash pixel sorted image onto original to ensure no unexpected transparencies
-    final_image.alpha_composite(output_img)
+    logging.debug("Done...")
+    return out
+
+
+def _sort_line_bands(
+    image: typing.Union[Image.Image, np.ndarray],
+    setup: SortSetup,
+    randomness: float,
+    sorting_function: str,
+    out: np.ndarray,
+) -> np.ndarray:
+    """sort_array within a memory budget. Every band of rows of the super pixel grid is gathered from the image,
+    sorted and put back into out on its own, so apart from the LineMap at angles other than right ones no temporary
+    array is the size of the grid. Random draws are made band after band in row order, so the result is the same as
+    sorting the whole grid."""
+    cols, rows = setup.grid_size
+    # Line maps gather from the whole image, while at right angles the bands
+    # of an array, e.g. a memory-mapped one, are only converted one by one.
+    if isinstance(image, np.ndarray) and setup.line_map is None:
+        original = image
+    else:
+        original = rgba_pixels(image)
+    sort_function = sorting_choices[sorting_function]
+    rng = np.random.default_rng(setup.seed)
+    pixel_bytes = _PLACE_BYTES_PER_PIXEL
+    if setup.line_map is not None:
+        pixel_bytes += _LINE_BYTES_PER_PIXEL
+    band_rows = setup._band_rows(cols, pixel_bytes)
+    band_height = band_rows * setup.super_pixel_size
+    # Bands read pixels around their own, so the image may only be
+    # overwritten once all of them are sorted.
+    result = np.empty_like(out) if np.may_share_memory(out, original) else out
+    # Bands without masked super pixels are skipped, leaving the original
+    skip = setup._mask_pixels is not None
+    if skip:
 
+        def copy_band(start: int, stop: int):
+            result[start:stop] = rgba_pixels(original[start:stop])
+
+        map_row_bands(copy_band, original.shape[0], band_height=band_height)
+
+    local = (
+        setup._intervals is None and setup.interval_function in LOCAL_INTERVAL_FUNCTIONS
+    )
+    if not local:
+        # Only the grid's size is looked at, so they are determined for the
+        # whole grid, drawing from rng as without a budget
+        intervals = IntervalSet.from_rows(setup.intervals(_Grid((cols, rows)), rng))
+    margin = LOCAL_MARGIN if local else 0
+
+    logging.debug("Sorting pixels...")
+    for start, stop in row_bands(rows, 1, band_rows):
+        setup.check_cancelled()
+        mask_data = setup.mask_rows(start, stop)
+        if skip and not mask_data.any():
+            continue
+        # Local intervals look at the super pixels around them
+        top, bottom = max(start - margin, 0), min(stop + margin, rows)
+        super_pixel_image = setup.prepare(original, (0, top, cols, bottom))
+        if local:
+            band_intervals = IntervalSet.from_rows(
+                setup.intervals(super_pixel_image, rng, (0, top, cols, bottom))
+            ).band(start - top, stop - top)
+            super_pixel_image = super_pixel_image.crop(
+                (0, start - top, cols, stop - top)
+            )
+        else:
+            band_intervals = intervals.band(start, stop)
+        setup.check_cancelled()
+        with stage(setup.profile, "sort_image"):
+            perm = sort_image(
+                super_pixel_image.size,
+                super_pixel_image,
+                mask_data,
+                band_intervals,
+                randomness,
+                sort_function,
+                rng,
+                setup.workers,
+            )
+        with stage(setup.profile, "place_blocks"):
+            output = _place_blocks(perm, super_pixel_image, setup.workers)
+        with stage(setup.profile, "unrotate"):
+            _paste_region(output, (0, start, cols, stop), setup, result)
+        del perm, output, super_pixel_image
+
+    if result[..., 3].min() == 255:
+        if result is not out:
+            out[...] = result
+    else:
+        setup.check_cancelled()
+        with stage(setup.profile, "composite"):
+            _composite(original, result, out, band_height)
     logging.debug("Done...")
-    return final_image
+    return out
+
+
+def _composite(
+    original: np.ndarray,
+    result: np.ndarray,
+    out: np.ndarray,
+    band_height: typing.Optional[int] = None,
+):
+    """Squashes the pixel sorted result onto the original, an RGB(A) array, into out, to ensure no unexpected
+    transparencies. Each band of rows of the original is read before the same rows of out are written, so out may be
+    the original itself. Bands are at most band_height rows high if given."""
+
+    def composite_band(start: int, stop: int):
+        final_image = Image.fromarray(
+            np.ascontiguousarray(rgba_pixels(original[start:stop])), "RGBA"
+        )
+        final_image.alpha_composite(
+            Image.fromarray(np.ascontiguousarray(result[start:stop]), "RGBA")
+        )
+        out[start:stop] = np.asarray(final_image)
+
+    map_row_bands(composite_band, original.shape[0], band_height=band_height)
+
+
+def _size(image: typing.Union[Image.Image, np.ndarray]) -> typing.Tuple[int, int]:
+    """(width, height) of an image or array."""
+    if isinstance(image, np.ndarray):
+        return image.shape[1], image.shape[0]
+    return image.size
+
+
+def rgba_pixels(image: typing.Union[Image.Image, np.ndarray]) -> np.ndarray:
+    """An image's pixels as a (height, width, 4) uint8 array. RGBA arrays are returned as they are, RGB and grayscale
+    (height, width) arrays are copied to add an opaque alpha channel."""
+    if not isinstance(image, np.ndarray):
+        return np.asarray(image.convert("RGBA"))
+    if image.ndim == 2:
+        image = image[..., None]
+    if image.dtype != np.uint8 or image.ndim != 3 or image.shape[2] not in (1, 3, 4):
+        raise ValueError(
+            f"expected a (height, width, 3|4) uint8 array, got {image.shape} {image.dtype}"
+        )
+    if image.shape[2] == 4:
+        return image
+    pixels = np.empty(image.shape[:2] + (4,), dtype=np.uint8)
+    pixels[..., :3] = image
+    pixels[..., 3] = 255
+    return pixels
+
+
+def _pack(intervals: IntervalSet) -> np.ndarray:
+    return np.concatenate((intervals.offsets, intervals.boundaries))
 
 
 def _mask_array(
-    mask_image: Image.Image, super_pixel_image: SuperPixelImage
+    mask_image: Image.Image, super_pixel_size: int, size: typing.Tuple[int, int]
 ) -> np.ndarray:
-    """Mask as a boolean array on the super pixel grid: a block is sortable
-    if any of its pixels are masked for sorting."""
-    if super_pixel_image.super_pixel_size > 1:
-        mask_image = mask_image.reduce(super_pixel_image.super_pixel_size)
-    cols, rows = super_pixel_image.size
+    """Mask as a boolean array on the super pixel grid of the given size: a
+    block is sortable if any of its pixels are masked for sorting."""
+    if super_pixel_size > 1:
+        mask_image = mask_image.reduce(super_pixel_size)
+    cols, rows = size
     mask = np.zeros((rows, cols), dtype=bool)
     source = np.asarray(mask_image)[:rows, :cols] > 0
     mask[: source.shape[0], : source.shape[1]] = source
     return mask
 
 
-def _place_blocks(perm: np.ndarray, super_pixel_image: SuperPixelImage) -> Image.Image:
+def _paste_region(
+    pixels: np.ndarray,
+    box: typing.Tuple[int, int, int, int],
+    setup: SortSetup,
+    out: np.ndarray,
+):
+    """Puts the pixels of a box (left, top, right, bottom) of the super pixel
+    grid back at their place in out."""
+    block = setup.super_pixel_size
+    left, top = box[0] * block, box[1] * block
+    height, width = pixels.shape[:2]
+    if setup.line_map is None:
+        np.rot90(out, setup.quarter_turns)[
+            top : top + height, left : left + width
+        ] = pixels
+        return
+    index = setup.line_map.index[top : top + height, left : left + width]
+    valid = index >= 0
+    y, x = np.divmod(index[valid], setup.size[0])
+    out[y, x] = pixels[valid]
+
+
+def _place_blocks(
+    perm: np.ndarray,
+    super_pixel_image: SuperPixelImage,
+    workers: int = 1,
+    out: typing.Optional[np.ndarray] = None,
+    band_height: typing.Optional[int] = None,
+) -> np.ndarray:
     """Rearranges the source image's super pixel blocks according to perm in
-    one vectorized operation, at full resolution."""
+    one vectorized operation per band of rows, at full resolution, into out
+    if given. Bands are at most band_height rows of blocks high if given."""
+    source_width, source_height = super_pixel_image.original_size
+    if out is None:
+        out = np.empty((source_height, source_width, 4), dtype=np.uint8)
+    row_view = block_rows(super_pixel_image)
+    block = super_pixel_image.super_pixel_size
+
+    def place_band(start: int, stop: int):
+        out[start * block : stop * block] = gather_rows(
+            row_view, perm, block, start, stop, super_pixel_image.original_size
+        )
+
+    map_row_bands(place_band, super_pixel_image.size[1], workers, band_height)
+    return out
+
+
+def block_rows(super_pixel_image: SuperPixelImage) -> np.ndarray:
+    """The source image as (rows, block, cols * block, 4) rows of super pixel
+    blocks. Padding the image to whole blocks copies it, otherwise this is a
+    view, even of strided arrays."""
     block = super_pixel_image.super_pixel_size
     cols, rows = super_pixel_image.size
     source_width, source_height = super_pixel_image.original_size
-
-    source = np.asarray(super_pixel_image.source_image)
+    source = super_pixel_image.source
     pad_h = rows * block - source_height
     pad_w = cols * block - source_width
-    source = np.pad(source, ((0, pad_h), (0, pad_w), (0, 0)))
+    if pad_h or pad_w:
+        source = np.pad(source, ((0, pad_h), (0, pad_w), (0, 0)))
+    return source.reshape(rows, block, cols * block, 4)
 
-    # One row of blocks at a time: map each output pixel column to its source
-    # column, then gather. Padded (transparent) pixels travel with blocks that
-    # straddle the right/bottom edge, matching the old paste() behavior.
-    row_view = source.reshape(rows, block, cols * block, 4)
-    col_map = (perm[:, :, None] * block + np.arange(block)).reshape(rows, cols * block)
-    output = np.take_along_axis(row_view, col_map[:, None, :, None], axis=2)
-    output = output.reshape(rows * block, cols * block, 4)
 
-    return Image.fromarray(output[:source_height, :source_width], "RGBA")
+def gather_rows(
+    row_view: np.ndarray,
+    perm: np.ndarray,
+    block: int,
+    start: int,
+    stop: int,
+    size: typing.Tuple[int, int],
+) -> np.ndarray:
+    """The pixels of rows start to stop of blocks placed according to perm,
+    cropped to the source image's size (width, height)."""
+    # Map each output pixel column to its source column, then gather. Padded
+    # (transparent) pixels travel with blocks that straddle the right/bottom
+    # edge, matching the old paste() behavior.
+    cols = perm.shape[1]
+    col_map = perm[start:stop, :, None].astype(np.intp) * block + np.arange(block)
+    col_map = col_map.reshape(stop - start, 1, cols * block, 1)
+    pixels = np.take_along_axis(row_view[start:stop], col_map, axis=2)
+    pixels = pixels.reshape((stop - start) * block, cols * block, 4)
+    width, height = size
+    return pixels[: height - start * block, :width]
@@ -0,0 +1,43 @@
+import typing
+from concurrent.futures import ThreadPoolExecutor
+
+# Bands per worker thread, so a worker that finishes early picks up more work
+# instead of idling while one slow band (e.g. dense intervals) completes.
+_BANDS_PER_WORKER = 4
+
+
+def row_bands(
+    height: int, workers: int, band_height: typing.Optional[int] = None
+) -> typing.List[typing.Tuple[int, int]]:
+    """Splits rows 0 to height into (start, stop) bands of nearly equal size, enough to keep workers threads busy and
+    at most band_height rows high if given."""
+    count = workers * _BANDS_PER_WORKER if workers > 1 else 1
+    if band_height:
+        count = max(count, -(-height // band_height))
+    count = max(min(height, count), 1)
+    edges = [height * i // count for i in range(count + 1)]
+    return list(zip(edges[:-1], edges[1:]))
+
+
+def map_row_bands(
+    function: typing.Callable[[int, int], None],
+    height: int,
+    workers: int = 1,
+    band_height: typing.Optional[int] = None,
+) -> None:
+    """
+    Calls function(start, stop) for bands of rows covering 0 to height, on a thread pool if workers > 1. NumPy releases
+    the GIL in most array operations, so functions that work on whole bands of rows run in parallel.
+    :param function: processes the rows from start to stop, usually writing into a shared array
+    :param height: number of rows
+    :param workers: number of threads
+    :param band_height: largest number of rows per band, to bound the temporary arrays function allocates
+    """
+    bands = row_bands(height, workers, band_height)
+    if workers <= 1:
+        for start, stop in bands:
+            function(start, stop)
+        return
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        # list() re-raises the first exception of any band
+        list(pool.map(lambda band: function(*band), bands))
@@ -0,0 +1,81 @@
+import logging
+import typing
+
+import numpy as np
+from PIL import Image
+
+from pixelsort.constants import (
+    DEFAULTS,
+    GEOMETRY_PARAMETERS,
+    INTERVAL_PARAMETERS,
+    SORTING_PARAMETERS,
+)
+from pixelsort.main import SortSetup, sort_array
+
+# Parameters that may differ between passes, the same ones a sweep may vary.
+PASS_PARAMETERS = GEOMETRY_PARAMETERS + INTERVAL_PARAMETERS + SORTING_PARAMETERS
+
+
+def pixelsort_passes(
+    image: typing.Union[Image.Image, np.ndarray],
+    passes: typing.Sequence[dict],
+    mask_image: typing.Union[np.ndarray, Image.Image, None] = None,
+    interval_image: typing.Union[np.ndarray, Image.Image, None] = None,
+    seed: typing.Optional[int] = None,
+    **options,
+) -> Image.Image:
+    """
+    pixelsorts an image several times in a row, e.g. vertically and then horizontally for the look of Kim Asendorf's
+    ASDFPixelSort, without encoding the image in between. Every pass sorts the result of the one before in place in
+    one RGBA buffer, and passes with the same angle and super pixel size share their rotated mask grid.
+    :param image: image to pixelsort, or an (height, width, 3|4) uint8 array
+    :param passes: keyword arguments of every pass, see PASS_PARAMETERS. Parameters a pass leaves out take their
+        default values.
+    :param mask_image: Image used for masking parts of the image, in every pass.
+    :param interval_image: Image used to define intervals, in every pass. Must be black and white.
+    :param seed: Seed for random intervals and randomness. Passes draw from one generator, one after the other.
+    :param options: remaining keyword arguments for pixelsort shared by all passes, e.g. workers
+    :return: pixelsorted image
+    """
+    if not passes:
+        raise ValueError("at least one pass is needed")
+    for parameters in passes:
+        unknown = set(parameters) - set(PASS_PARAMETERS)
+        if unknown:
+            raise TypeError(f"cannot vary {', '.join(sorted(unknown))} between passes")
+    size = image.size if isinstance(image, Image.Image) else image.shape[1::-1]
+    rng = np.random.default_rng(seed) if seed is not None else None
+
+    setups = {}
+    result = None
+    for i, parameters in enumerate(passes):
+        parameters = {
+            name: parameters.get(name, DEFAULTS[name]) for name in PASS_PARAMETERS
+        }
+        geometry = tuple(parameters[name] for name in GEOMETRY_PARAMETERS)
+        if geometry not in setups:
+            setups[geometry] = SortSetup(
+                size,
+                mask_image=mask_image,
+                interval_image=interval_image,
+                seed=rng,
+                **dict(zip(GEOMETRY_PARAMETERS, geometry)),
+                **options,
+            )
+        logging.debug(f"Sorting pass {i + 1} of {len(passes)}...")
+        # The first pass reads the input, later ones overwrite their input.
+        source = image if result is None else result
+        # Preparing on the shared setup builds its mask grid once for all
+        # passes with this geometry, including their copies below.
+        super_pixel_image = setups[geometry].prepare(source)
+        setup = setups[geometry].with_intervals(
+            **{name: parameters[name] for name in INTERVAL_PARAMETERS}
+        )
+        result = sort_array(
+            source,
+            setup,
+            super_pixel_image=super_pixel_image,
+            out=result,
+            **{name: parameters[name] for name in SORTING_PARAMETERS},
+        )
+    return Image.fromarray(result, "RGBA")
@@ -0,0 +1,281 @@
+import concurrent.futures
+import logging
+import math
+import time
+import typing
+
+import numpy as np
+from PIL import Image
+
+from pixelsort.constants import (
+    DEFAULTS,
+    GEOMETRY_PARAMETERS,
+    INTERVAL_PARAMETERS,
+    SORTING_PARAMETERS,
+)
+from pixelsort.interval_set import IntervalSet
+from pixelsort.main import SortSetup, sort_array
+from pixelsort.super_pixel_image import SuperPixelImage
+
+# Parameters that may change between renders of a preview.
+PREVIEW_PARAMETERS = GEOMETRY_PARAMETERS + INTERVAL_PARAMETERS + SORTING_PARAMETERS
+# Interval functions whose intervals only come from the random generator, so
+# the full render can take them from the preview and look the same.
+REUSABLE_INTERVAL_FUNCTIONS = {"random", "waves"}
+
+# Initial guess of the pixels a preview sorts per second, refined after every
+# preview.
+_PIXELS_PER_SECOND = 4e6
+# Weight of the latest preview in the measured speed, which smooths out
+# previews that are quick or slow because of their parameters.
+_SPEED_WEIGHT = 0.5
+# The factor is kept while a preview at it is expected to take between these
+# multiples of the latency target, as changing it reduces the image again.
+_LATENCY_SLACK = (0.5, 1.25)
+
+
+class Preview:
+    """
+    Renders an image quickly at a reduced resolution while parameters are tuned, and at full resolution once they are
+    settled. The image is reduced with the SuperPixelImage machinery, by a factor chosen so a preview takes about the
+    latency target; the factor adapts to the measured speed of every preview.
+
+    After each preview, the full resolution render of its parameters starts on a background thread, or with refine().
+    It reuses what does not change between renders: the image converted to RGBA, the rotated image and its sort keys
+    while the angle and super pixel size stay the same, and random and wave intervals, which are the preview's scaled
+    up so the result looks like the preview. Other interval functions are determined at full resolution, which makes
+    the result the same as pixelsort().
+
+    >>> with Preview(image, latency=0.5) as preview:
+    ...     preview.render(lower_threshold=0.3)
+    ...     preview.render(lower_threshold=0.4, angle=90)
+    ...     result = preview.refine()
+    """
+
+    def __init__(
+        self,
+        image: typing.Union[Image.Image, np.ndarray],
+        mask_image: typing.Union[np.ndarray, Image.Image, None] = None,
+        interval_image: typing.Union[np.ndarray, Image.Image, None] = None,
+        latency: float = 0.5,
+        background: bool = True,
+        **options,
+    ):
+        """
+        :param image: image to pixelsort, or an (height, width, 3|4) uint8 array
+        :param mask_image: Image used for masking parts of the image.
+        :param interval_image: Image used to define intervals. Must be black and white.
+        :param latency: time in seconds a preview should take
+        :param background: start the full resolution render after every preview, instead of only on refine()
+        :param options: remaining keyword arguments for pixelsort except those in PREVIEW_PARAMETERS, e.g. seed or
+            workers. Previews only use seed and workers.
+        """
+        unknown = set(options) & set(PREVIEW_PARAMETERS)
+        if unknown:
+            raise TypeError(
+                f"pass {', '.join(sorted(unknown))} to render() instead of Preview()"
+            )
+        if isinstance(image, Image.Image):
+            # Converted once for every render
+            image = np.asarray(image.convert("RGBA"))
+        self.image = image
+        self.mask_image = _as_image(mask_image)
+        self.interval_image = _as_image(interval_image)
+        self.latency = latency
+        self.background = background
+        self.options = options
+        #: Measured preview speed, which chooses the reduction factor.
+        self.pixels_per_second = _PIXELS_PER_SECOND
+
+        # refine() before any preview renders the defaults
+        self._parameters = {name: DEFAULTS[name] for name in PREVIEW_PARAMETERS}
+        self._intervals = None
+        self._factor = None
+        self._reduced = None
+        self._previews = {}
+        self._full = None
+        self._pool = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        self._future = None
+        # Number of the last render, so older background renders can stop
+        self._generation = 0
+
+    @property
+    def factor(self) -> int:
+        """Factor the image is reduced by for the next preview."""
+        height, width = self.image.shape[:2]
+        if self._factor is not None:
+            expected = width * height / self._factor**2 / self.pixels_per_second
+            low, high = _LATENCY_SLACK
+            if low * self.latency <= expected <= high * self.latency:
+                return self._factor
+        pixels = self.latency * self.pixels_per_second
+        return max(math.ceil(math.sqrt(width * height / pixels)), 1)
+
+    def render(self, **parameters) -> Image.Image:
+        """
+        Renders a preview at reduced resolution and, in background mode, starts the full render of the same parameters.
+        :param parameters: pixelsort keyword arguments, see PREVIEW_PARAMETERS. Parameters left out take their default
+            values.
+        :return: pixelsorted preview
+        """
+        unknown = set(parameters) - set(PREVIEW_PARAMETERS)
+        if unknown:
+            raise TypeError(f"cannot preview {', '.join(sorted(unknown))}")
+        parameters = {
+            name: parameters.get(name, DEFAULTS[name]) for name in PREVIEW_PARAMETERS
+        }
+        if self._future is not None:
+            # Obsolete; dropped if it has not started, and stopped after
+            # preparing the reusable work if it has
+            self._future.cancel()
+            self._future = None
+        self._generation += 1
+
+        factor = self.factor
+        setup, super_pixel_image = self._preview_setup(factor, parameters)
+        # Reducing and preparing the image only happen when the factor, angle
+        # or super pixel size change, so they are left out of the speed.
+        start = time.perf_counter()
+        interval_parameters = self._interval_parameters(
+            parameters, factor, super_pixel_image
+        )
+        # Determined here rather than by sort_array, to keep them for the full render
+        intervals = setup.with_intervals(**interval_parameters).intervals(
+            super_pixel_image, np.random.default_rng(self.options.get("seed"))
+        )
+        setup = setup.with_intervals(intervals=intervals, **interval_parameters)
+        result = sort_array(
+            self._reduced,
+            setup,
+            super_pixel_image=super_pixel_image,
+            **{name: parameters[name] for name in SORTING_PARAMETERS},
+        )
+        elapsed = time.perf_counter() - start
+        speed = result.shape[0] * result.shape[1] / max(elapsed, 1e-3)
+        self.pixels_per_second += _SPEED_WEIGHT * (speed - self.pixels_per_second)
+        logging.debug(f"Preview at 1/{factor} scale took {elapsed:.3f}s")
+
+        self._parameters = parameters
+        self._intervals = (
+            (intervals, super_pixel_image.size)
+            if parameters["interval_function"] in REUSABLE_INTERVAL_FUNCTIONS
+            else None
+        )
+        if self.background:
+            self._submit()
+        return Image.fromarray(result, "RGBA")
+
+    def refine(self) -> Image.Image:
+        """The full resolution render of the last previewed parameters, or of the defaults before any preview, waiting
+        for the background render if one is running."""
+        if self._future is None:
+            self._submit()
+        return self._future.result()
+
+    def close(self):
+        """Stops the background thread, dropping a render that has not started."""
+        self._pool.shutdown(cancel_futures=True)
+
+    def __enter__(self) -> "Preview":
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+    def _submit(self):
+        self._future = self._pool.submit(
+            self._render_full, self._generation, self._parameters, self._intervals
+        )
+
+    def _preview_setup(
+        self, factor: int, parameters: dict
+    ) -> typing.Tuple[SortSetup, SuperPixelImage]:
+        """SortSetup and prepared image for the preview at factor, kept while factor, angle and super pixel size stay
+        the same."""
+        if factor != self._factor:
+            self._previews = {}
+            self._factor = factor
+            self._reduced = SuperPixelImage(self.image, factor).average_colors
+        super_pixel_size = max(parameters["super_pixel_size"] // factor, 1)
+        key = (parameters["angle"], super_pixel_size)
+        if key not in self._previews:
+            setup = SortSetup(
+                self._reduced.shape[1::-1],
+                mask_image=_reduce(self.mask_image, factor),
+                interval_image=_reduce(self.interval_image, factor),
+                angle=parameters["angle"],
+                super_pixel_size=super_pixel_size,
+                seed=self.options.get("seed"),
+                workers=self.options.get("workers", 1),
+            )
+            self._previews[key] = setup, setup.prepare(self._reduced)
+        return self._previews[key]
+
+    @staticmethod
+    def _interval_parameters(
+        parameters: dict, factor: int, super_pixel_image: SuperPixelImage
+    ) -> dict:
+        """Interval parameters for the preview, with char_length scaled to the same length in full resolution
+        pixels."""
+        interval_parameters = {name: parameters[name] for name in INTERVAL_PARAMETERS}
+        full_size = parameters["super_pixel_size"]
+        preview_size = super_pixel_image.super_pixel_size * factor
+        char_length = parameters["char_length"] * full_size / preview_size
+        if parameters["interval_function"] == "random":
+            # Random intervals need more than one super pixel
+            char_length = max(char_length, 2)
+        interval_parameters["char_length"] = char_length
+        return interval_parameters
+
+    def _render_full(
+        self,
+        generation: int,
+        parameters: dict,
+        intervals: typing.Optional[typing.Tuple[IntervalSet, typing.Tuple[int, int]]],
+    ) -> typing.Optional[Image.Image]:
+        """Runs on the background thread: renders parameters at full resolution, or returns None once a newer render
+        started."""
+        geometry = tuple(parameters[name] for name in GEOMETRY_PARAMETERS)
+        if self._full is None or self._full[0] != geometry:
+            # Dropped first, so two rotated copies are never held at once
+            self._full = None
+            setup = SortSetup(
+                self.image.shape[1::-1],
+                mask_image=self.mask_image,
+                interval_image=self.interval_image,
+                **dict(zip(GEOMETRY_PARAMETERS, geometry)),
+                **self.options,
+            )
+            self._full = geometry, setup, setup.prepare(self.image)
+        _, setup, super_pixel_image = self._full
+        if generation != self._generation:
+            return None
+        if intervals is not None:
+            preview_intervals, preview_size = intervals
+            intervals = preview_intervals.resized(preview_size, super_pixel_image.size)
+        setup = setup.with_intervals(
+            intervals=intervals,
+            **{name: parameters[name] for name in INTERVAL_PARAMETERS},
+        )
+        result = sort_array(
+            self.image,
+            setup,
+            super_pixel_image=super_pixel_image,
+            **{name: parameters[name] for name in SORTING_PARAMETERS},
+        )
+        return Image.fromarray(result, "RGBA")
+
+
+def _as_image(
+    image: typing.Union[np.ndarray, Image.Image, None],
+) -> typing.Optional[Image.Image]:
+    return Image.fromarray(image) if isinstance(image, np.ndarray) else image
+
+
+def _reduce(
+    image: typing.Optional[Image.Image], factor: int
+) -> typing.Optional[Image.Image]:
+    """A mask or interval image at preview scale."""
+    if image is None or factor == 1:
+        return image
+    return image.convert("L").reduce(factor)
@@ -0,0 +1,122 @@
+import contextlib
+import sys
+import time
+import tracemalloc
+import typing
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+class StageStats:
+    """Resources used by one run of a pipeline stage."""
+
+    def __init__(self, name: str, wall: float, cpu: float, peak_bytes: int):
+        self.name = name
+        #: Elapsed time in seconds.
+        self.wall = wall
+        #: CPU time of the whole process in seconds, including helper threads.
+        self.cpu = cpu
+        #: Largest amount of memory allocated during the stage on top of what was allocated before it, in bytes. Only
+        #: allocations visible to tracemalloc are counted, which includes NumPy arrays but not Pillow image buffers.
+        self.peak_bytes = peak_bytes
+
+    def as_dict(self) -> dict:
+        return {
+            "name": self.name,
+            "wall_seconds": self.wall,
+            "cpu_seconds": self.cpu,
+            "peak_bytes": self.peak_bytes,
+        }
+
+
+class Profile:
+    """
+    Collects per-stage timings and peak allocations of pixelsort runs. Pass one to pixelsort() (or SortSetup) and read
+    it afterwards:
+
+    >>> profile = Profile()
+    >>> pixelsort(image, profile=profile)
+    >>> print(profile.table())
+    """
+
+    def __init__(self, trace_memory: bool = True):
+        """
+        :param trace_memory: record peak allocations with tracemalloc, which slows down allocation heavy Python code
+        """
+        self.trace_memory = trace_memory
+        self.stages: typing.List[StageStats] = []
+
+    @contextlib.contextmanager
+    def stage(self, name: str):
+        """Context manager recording the resources used by the code it wraps as stage name."""
+        started_tracing = self.trace_memory and not tracemalloc.is_tracing()
+        if started_tracing:
+            tracemalloc.start()
+        if self.trace_memory:
+            tracemalloc.reset_peak()
+            allocated = tracemalloc.get_traced_memory()[0]
+        wall, cpu = time.perf_counter(), time.process_time()
+        try:
+            yield
+        finally:
+            wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+            peak = 0
+            if self.trace_memory:
+                peak = max(tracemalloc.get_traced_memory()[1] - allocated, 0)
+            if started_tracing:
+                tracemalloc.stop()
+            self.stages.append(StageStats(name, wall, cpu, peak))
+
+    def totals(self) -> typing.List[StageStats]:
+        """Stats summed per stage name, in the order stages first ran. Peaks are the largest of any run."""
+        totals: typing.Dict[str, StageStats] = {}
+        for stats in self.stages:
+            total = totals.setdefault(stats.name, StageStats(stats.name, 0.0, 0.0, 0))
+            total.wall += stats.wall
+            total.cpu += stats.cpu
+            total.peak_bytes = max(total.peak_bytes, stats.peak_bytes)
+        return list(totals.values())
+
+    def as_dict(self) -> dict:
+        return {
+            "stages": [stats.as_dict() for stats in self.stages],
+            "totals": [stats.as_dict() for stats in self.totals()],
+            "peak_rss_bytes": peak_rss(),
+        }
+
+    def table(self) -> str:
+        """The per-stage totals as a plain text table."""
+        lines = [f"{'stage':<18} {'wall ms':>10} {'cpu ms':>10} {'peak MiB':>10}"]
+        totals = self.totals()
+        for stats in totals:
+            lines.append(
+                f"{stats.name:<18} {stats.wall * 1000:10.1f} {stats.cpu * 1000:10.1f} "
+                f"{stats.peak_bytes / 2**20:10.1f}"
+            )
+        lines.append(
+            f"{'total':<18} {sum(s.wall for s in totals) * 1000:10.1f} "
+            f"{sum(s.cpu for s in totals) * 1000:10.1f} "
+            f"{max((s.peak_bytes for s in totals), default=0) / 2**20:10.1f}"
+        )
+        rss = peak_rss()
+        if rss is not None:
+            lines.append(f"{'peak RSS':<18} {'':>10} {'':>10} {rss / 2**20:10.1f}")
+        return "\n".join(lines)
+
+
+def stage(profile: typing.Optional[Profile], name: str):
+    """profile.stage(name), or a no-op context manager when not profiling."""
+    return profile.stage(name) if profile is not None else contextlib.nullcontext()
+
+
+def peak_rss() -> typing.Optional[int]:
+    """Largest resident set size of the process so far in bytes, including Pillow's buffers, or None where the
+    platform does not report it."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes, except on macOS
+    return peak if sys.platform == "darwin" else peak * 1024
@@ -0,0 +1,101 @@
+import logging
+import os
+import typing
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image, ImageSequence
+
+from pixelsort.constants import DEFAULTS
+from pixelsort.main import SortSetup, sort_frame
+
+# Output formats that can hold several frames in one file.
+ANIMATED_EXTENSIONS = (".gif", ".png", ".apng", ".tif", ".tiff", ".webp")
+
+
+def pixelsort_frames(
+    frames: typing.Sequence[Image.Image],
+    workers: int = 1,
+    randomness: float = DEFAULTS["randomness"],
+    sorting_function: str = DEFAULTS["sorting_function"],
+    **options,
+) -> typing.List[Image.Image]:
+    """
+    pixelsorts every frame of an animation. The mask grid, interval image and file based intervals are prepared once
+    for the whole sequence, and frames are sorted in parallel on a thread pool.
+    :param frames: frames to pixelsort, all of the same size
+    :param workers: number of frames sorted at the same time
+    :param randomness: What percentage of intervals *not* to sort. 0 by default.
+    :param sorting_function: Sorting function to use for sorting the pixels.
+    :param options: remaining keyword arguments for pixelsort, see SortSetup. With a seed, every frame gets the same
+        random intervals.
+    :return: pixelsorted frames
+    """
+    if not frames:
+        return []
+    setup = SortSetup(frames[0].size, **options)
+
+    def sort(frame: Image.Image) -> Image.Image:
+        return sort_frame(frame, setup, randomness, sorting_function)
+
+    if workers <= 1:
+        return [sort(frame) for frame in frames]
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(sort, frames))
+
+
+def is_animated(paths: typing.Sequence[str]) -> bool:
+    """Whether the given input paths are a single multi-frame image file."""
+    if len(paths) != 1 or not os.path.isfile(paths[0]):
+        return False
+    try:
+        with Image.open(paths[0]) as image:
+            return getattr(image, "n_frames", 1) > 1
+    except OSError:
+        return False
+
+
+def load_frames(
+    paths: typing.Sequence[str],
+) -> typing.Tuple[typing.List[Image.Image], dict]:
+    """
+    Loads an animation, either from a single multi-frame file (GIF, APNG, TIFF stack, ...) or from one file per frame.
+    :param paths: one multi-frame file, or the frame files in order
+    :return: the frames, and the save options (frame durations, loop count) needed to write them back
+    """
+    if len(paths) == 1:
+        with Image.open(paths[0]) as image:
+            frames = [frame.convert("RGBA") for frame in ImageSequence.Iterator(image)]
+            durations = [frame.info.get("duration") for frame in frames]
+            save_options = {"loop": image.info.get("loop", 0)}
+    else:
+        frames = []
+        for path in paths:
+            with Image.open(path) as image:
+                frames.append(image.convert("RGBA"))
+        durations = [None]
+        save_options = {}
+    if all(duration is not None for duration in durations):
+        save_options["duration"] = durations
+    logging.debug(f"Loaded {len(frames)} frames")
+    return frames, save_options
+
+
+def save_frames(
+    frames: typing.Sequence[Image.Image], path: str, **save_options
+) -> None:
+    """
+    Saves frames as one animated file, or as numbered files inside path if it has no multi-frame image extension.
+    :param frames: frames to save
+    :param path: output file or directory
+    :param save_options: extra options for multi-frame files, e.g. duration and loop as returned by load_frames
+    """
+    extension = os.path.splitext(path)[1].lower()
+    if extension not in ANIMATED_EXTENSIONS:
+        os.makedirs(path, exist_ok=True)
+        digits = len(str(len(frames)))
+        for i, frame in enumerate(frames):
+            frame.save(os.path.join(path, f"{i:0{digits}d}.png"))
+        return
+    if extension == ".gif":
+        frames = [frame.convert("RGB") for frame in frames]
+    frames[0].save(path, save_all=True, append_images=frames[1:], **save_options)
@@ -0,0 +1,396 @@
+import argparse
+import base64
+import collections
+import hashlib
+import json
+import logging
+import math
+import threading
+import time
+import typing
+import urllib.parse
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+from pixelsort.constants import DEFAULTS, LOG_FORMAT
+from pixelsort.interval import interval_choices
+from pixelsort.main import pixelsort
+from pixelsort.sorting import sorting_choices
+from pixelsort.util import decode_image, encode_image
+
+# pixelsort() parameters accepted by the server, with the type or choices of
+# their values. Images are passed separately.
+PARAMETERS = {
+    "randomness": float,
+    "char_length": float,
+    "sorting_function": sorting_choices,
+    "interval_function": interval_choices,
+    "lower_threshold": float,
+    "upper_threshold": float,
+    "angle": float,
+    "super_pixel_size": int,
+    "seed": int,
+}
+# Smallest values of the numeric parameters that have one.
+MINIMUMS = {"super_pixel_size": 1, "seed": 0}
+# Output formats and their content types.
+FORMATS = {"png": "image/png", "jpeg": "image/jpeg", "webp": "image/webp"}
+
+# Number of recent request latencies kept for the percentiles in /metrics.
+_LATENCY_WINDOW = 1000
+# Bytes written to the client at a time.
+_CHUNK_SIZE = 2**16
+
+
+class Rejected(Exception):
+    """Raised when a request cannot be served, carrying the HTTP status to answer with."""
+
+    def __init__(self, status: HTTPStatus, message: str):
+        super().__init__(message)
+        self.status = status
+
+
+class SortServer(ThreadingHTTPServer):
+    """
+    HTTP server that pixelsorts images on a pool of worker processes, which are started and have imported pixelsort
+    before the first request arrives.
+
+    POST /sort with an encoded image as the body and pixelsort parameters (see PARAMETERS) plus an optional output
+    format in the query string, or with a JSON object holding the base64 encoded "image", optional "mask_image" and
+    "interval_image", the parameters and "format". The response is the encoded result.
+
+    GET /metrics returns request counts, the queue depth and latency percentiles as JSON.
+    """
+
+    daemon_threads = True
+
+    def __init__(
+        self,
+        address: typing.Tuple[str, int],
+        jobs: int = 1,
+        queue_limit: int = 16,
+        cache_size: int = 64,
+        max_request_bytes: int = 64 * 2**20,
+    ):
+        """
+        :param address: (host, port) to listen on
+        :param jobs: number of worker processes
+        :param queue_limit: number of requests waiting for a worker before new ones are rejected with 503
+        :param cache_size: number of results kept in the LRU result cache, 0 to disable it
+        :param max_request_bytes: largest request body accepted
+        """
+        super().__init__(address, _Handler)
+        self.jobs = jobs
+        self.cache_size = cache_size
+        self.max_request_bytes = max_request_bytes
+        self.pool = ProcessPoolExecutor(max_workers=jobs)
+        # Start every worker now rather than on the first requests.
+        for future in [self.pool.submit(_warm_up) for _ in range(jobs)]:
+            future.result()
+
+        self._slots = threading.BoundedSemaphore(jobs + queue_limit)
+        self._lock = threading.Lock()
+        self._cache: "collections.OrderedDict[str, bytes]" = collections.OrderedDict()
+        # Renders in progress, so identical concurrent requests share one.
+        self._running: typing.Dict[str, typing.Tuple[Future, ProcessPoolExecutor]] = {}
+        self._latencies: typing.Deque[float] = collections.deque(maxlen=_LATENCY_WINDOW)
+        self._counts = collections.Counter()
+        self._in_flight = 0
+
+    def render(self, request: dict) -> bytes:
+        """Encoded result of a parsed request, from the cache or a worker process. Raises Rejected."""
+        # Requests with unseeded randomness must not share results
+        key = _cache_key(request) if _is_deterministic(request) else None
+        submitted = False
+        with self._lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                self._counts["cache_hits"] += 1
+                return self._cache[key]
+            future, pool = self._running.get(key, (None, self.pool))
+            if future is None:
+                if not self._slots.acquire(blocking=False):
+                    self._counts["rejected"] += 1
+                    raise Rejected(HTTPStatus.SERVICE_UNAVAILABLE, "server busy")
+                self._counts["cache_misses"] += 1
+                try:
+                    future = pool.submit(_render, **request)
+                except BrokenProcessPool:
+                    self._slots.release()
+                    self._replace_pool(pool)
+                    raise Rejected(
+                        HTTPStatus.SERVICE_UNAVAILABLE, "worker process died"
+                    )
+                self._in_flight += 1
+                submitted = True
+                if key is not None:
+                    self._running[key] = (future, pool)
+        if submitted:
+            # Outside the lock: a future that is already done, e.g. by a pool
+            # breaking, calls back right away, and _finish takes the lock.
+            future.add_done_callback(lambda _: self._finish(key))
+        try:
+            result = future.result()
+        except (ValueError, TypeError, OSError) as e:
+            raise Rejected(HTTPStatus.BAD_REQUEST, str(e))
+        except BrokenProcessPool:
+            with self._lock:
+                self._replace_pool(pool)
+            raise Rejected(HTTPStatus.SERVICE_UNAVAILABLE, "worker process died")
+        if key is not None and self.cache_size:
+            with self._lock:
+                self._cache[key] = result
+                self._cache.move_to_end(key)
+                while len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+        return result
+
+    def _replace_pool(self, pool: ProcessPoolExecutor):
+        """Starts a new pool in place of one that broke when a worker process died, e.g. killed for running out of
+        memory, unless that was already done. Called holding the lock."""
+        if self.pool is not pool:
+            return
+        logging.error("A worker process died, starting new ones")
+        self.pool = ProcessPoolExecutor(max_workers=self.jobs)
+        self._counts["pool_restarts"] += 1
+        pool.shutdown(wait=False)
+
+    def _finish(self, key: typing.Optional[str]):
+        with self._lock:
+            self._running.pop(key, None)
+            self._in_flight -= 1
+        self._slots.release()
+
+    def record(self, status: int, seconds: float):
+        with self._lock:
+            self._counts["requests"] += 1
+            self._counts[f"status_{status}"] += 1
+            self._latencies.append(seconds)
+
+    def metrics(self) -> dict:
+        with self._lock:
+            latencies = np.array(self._latencies)
+            in_flight = self._in_flight
+            metrics = dict(self._counts)
+            metrics["cache_entries"] = len(self._cache)
+        metrics["in_flight"] = in_flight
+        metrics["queue_depth"] = max(in_flight - self.jobs, 0)
+        metrics["workers"] = self.jobs
+        for percentile in (50, 90, 99):
+            metrics[f"latency_p{percentile}_ms"] = (
+                float(np.percentile(latencies, percentile) * 1000)
+                if latencies.size
+                else None
+            )
+        return metrics
+
+    def server_close(self):
+        super().server_close()
+        self.pool.shutdown(cancel_futures=True)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    server: SortServer
+
+    def do_GET(self):
+        path = urllib.parse.urlsplit(self.path).path
+        if path == "/metrics":
+            self._send(HTTPStatus.OK, "application/json", _json(self.server.metrics()))
+        else:
+            self._send(HTTPStatus.NOT_FOUND, "text/plain", b"not found\n")
+
+    def do_POST(self):
+        start = time.perf_counter()
+        url = urllib.parse.urlsplit(self.path)
+        try:
+            if url.path != "/sort":
+                raise Rejected(HTTPStatus.NOT_FOUND, "not found")
+            request = self._parse(url.query)
+            result = self.server.render(request)
+            status = HTTPStatus.OK
+            self._send(status, FORMATS[request["image_format"]], result)
+        except Rejected as e:
+            status = e.status
+            self._send(status, "text/plain", f"{e}\n".encode())
+        except Exception:
+            logging.exception("Failed to sort an image")
+            status = HTTPStatus.INTERNAL_SERVER_ERROR
+            self._send(status, "text/plain", b"internal error\n")
+        self.server.record(status, time.perf_counter() - start)
+
+    def _parse(self, query: str) -> dict:
+        """Request body and query string as keyword arguments for _render."""
+        header = self.headers.get("Content-Length", "0")
+        try:
+            length = int(header)
+        except ValueError:
+            length = -1
+        # A negative length would read until the client closes the connection
+        if length < 0:
+            raise Rejected(HTTPStatus.BAD_REQUEST, f"invalid Content-Length: {header}")
+        if length > self.server.max_request_bytes:
+            raise Rejected(HTTPStatus.REQUEST_ENTITY_TOO_LARGE, "request too large")
+        body = self.rfile.read(length)
+        if self.headers.get_content_type() == "application/json":
+            try:
+                fields = json.loads(body)
+                images = {
+                    name: base64.b64decode(fields.pop(name))
+                    for name in ("image", "mask_image", "interval_image")
+                    if fields.get(name) is not None
+                }
+            except (ValueError, TypeError, AttributeError) as e:
+                raise Rejected(HTTPStatus.BAD_REQUEST, f"invalid JSON request: {e}")
+        else:
+            fields = dict(urllib.parse.parse_qsl(query))
+            images = {"image": body}
+        if not images.get("image"):
+            raise Rejected(HTTPStatus.BAD_REQUEST, "no image given")
+        image_format = fields.pop("format", "png")
+        if not isinstance(image_format, str) or image_format not in FORMATS:
+            raise Rejected(
+                HTTPStatus.BAD_REQUEST, f"format must be one of {', '.join(FORMATS)}"
+            )
+        return dict(
+            images, image_format=image_format, parameters=_parse_parameters(fields)
+        )
+
+    def _send(self, status: int, content_type: str, body: bytes):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        if status == HTTPStatus.SERVICE_UNAVAILABLE:
+            self.send_header("Retry-After", "1")
+        self.end_headers()
+        view = memoryview(body)
+        for start in range(0, len(body), _CHUNK_SIZE):
+            self.wfile.write(view[start : start + _CHUNK_SIZE])
+
+    def log_message(self, format, *args):
+        logging.info(f"{self.address_string()} {format % args}")
+
+
+def serve(
+    host: str = "127.0.0.1",
+    port: int = 8000,
+    jobs: int = 1,
+    queue_limit: int = 16,
+    cache_size: int = 64,
+) -> None:
+    """Runs a SortServer until interrupted."""
+    server = SortServer((host, port), jobs, queue_limit, cache_size)
+    logging.warning(f"Serving on http://{host}:{server.server_address[1]}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+def main(argv: typing.Sequence[str]) -> None:
+    """Entry point of python -m pixelsort serve."""
+    parser = argparse.ArgumentParser(
+        prog="python -m pixelsort serve",
+        description="Pixelsort images sent over HTTP.",
+    )
+    parser.add_argument("--host", default="127.0.0.1", help="Address to listen on")
+    parser.add_argument("--port", type=int, default=8000, help="Port to listen on")
+    parser.add_argument(
+        "-j", "--jobs", type=int, default=1, help="Number of worker processes"
+    )
+    parser.add_argument(
+        "--queue",
+        type=int,
+        default=16,
+        help="Requests waiting for a worker before new ones are rejected with 503",
+    )
+    parser.add_argument(
+        "--cache_size",
+        type=int,
+        default=64,
+        help="Number of results kept in memory, 0 to disable the cache",
+    )
+    parser.add_argument(
+        "-l",
+        "--log_level",
+        default="WARNING",
+        help="Print more or less info",
+        choices=["DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL"],
+    )
+    args = parser.parse_args(argv)
+    logging.basicConfig(format=LOG_FORMAT, level=logging.getLevelName(args.log_level))
+    serve(args.host, args.port, args.jobs, args.queue, args.cache_size)
+
+
+def _parse_parameters(fields: dict) -> dict:
+    parameters = {}
+    for name, value in fields.items():
+        value_type = PARAMETERS.get(name)
+        if value_type is None:
+            raise Rejected(HTTPStatus.BAD_REQUEST, f"unknown parameter: {name}")
+        if isinstance(value_type, dict):
+            # JSON requests may send any type, and lists cannot be looked up
+            if not isinstance(value, str) or value not in value_type:
+                raise Rejected(HTTPStatus.BAD_REQUEST, f"invalid {name}: {value}")
+        else:
+            try:
+                value = value_type(value)
+            except (ValueError, TypeError, OverflowError):
+                raise Rejected(HTTPStatus.BAD_REQUEST, f"invalid {name}: {value}")
+            if not math.isfinite(value) or value < MINIMUMS.get(name, -math.inf):
+                raise Rejected(HTTPStatus.BAD_REQUEST, f"invalid {name}: {value}")
+        parameters[name] = value
+    return parameters
+
+
+def _cache_key(request: dict) -> str:
+    digest = hashlib.sha256()
+    for name in ("image", "mask_image", "interval_image"):
+        digest.update(hashlib.sha256(request.get(name) or b"").digest())
+    digest.update(
+        json.dumps(
+            [request["image_format"], request["parameters"]], sort_keys=True
+        ).encode()
+    )
+    return digest.hexdigest()
+
+
+def _is_deterministic(request: dict) -> bool:
+    """Whether the same request always gives the same result, so it may be cached."""
+    parameters = request["parameters"]
+    if parameters.get("seed") is not None:
+        return True
+    random_intervals = parameters.get("interval_function") in ("random", "waves")
+    return not random_intervals and not parameters.get(
+        "randomness", DEFAULTS["randomness"]
+    )
+
+
+def _json(data: dict) -> bytes:
+    return (json.dumps(data, indent=1) + "\n").encode()
+
+
+def _warm_up():
+    pass
+
+
+def _render(
+    image: bytes,
+    image_format: str,
+    parameters: dict,
+    mask_image: typing.Optional[bytes] = None,
+    interval_image: typing.Optional[bytes] = None,
+) -> bytes:
+    """Runs in a worker process: decodes the images, pixelsorts and encodes the result."""
+    result = pixelsort(
+        decode_image(image),
+        mask_image=decode_image(mask_image) if mask_image else None,
+        interval_image=decode_image(interval_image) if interval_image else None,
+        **parameters,
+    )
+    return encode_image(result, image_format)
@@ -0,0 +1,355 @@
+import logging
+import typing
+
+import numpy as np
+from PIL import Image
+
+from pixelsort.constants import (
+    DEFAULTS,
+    INTERVAL_PARAMETERS,
+    SORTING_PARAMETERS,
+)
+from pixelsort.interval_set import IntervalSet, changed_rows
+from pixelsort.main import SortSetup, block_rows, gather_rows, rgba_pixels
+from pixelsort.parallel import map_row_bands
+from pixelsort.sorting import sort_rows, sorting_choices, unsorted_segments
+
+# Parameters update() can change. The angle and super pixel size shape the
+# whole grid, so they need a new session.
+SESSION_PARAMETERS = INTERVAL_PARAMETERS + SORTING_PARAMETERS
+
+# Default of update()'s images, which None would not tell from removing them.
+_UNCHANGED = object()
+
+
+class SortSession:
+    """
+    Keeps the intermediate state of pixelsorting one image, so an interactive editor can change the mask, the
+    thresholds or other interval and sorting parameters and only re-sort the rows of the super pixel grid whose
+    inputs changed. It holds the rotated SuperPixelImage with its sort keys, the mask grid, the intervals of every
+    row, the unsorted segments drawn for randomness and the permutation perm.
+
+    Intervals are determined for the whole grid again when their parameters change, which is cheap next to sorting,
+    and compared row by row. A brush stroke on the mask, given with its bounding box, only reads the rows of the mask
+    it covers, so its cost grows with the stroke's height rather than the image's. The result always equals
+    pixelsort() with the current inputs and seed.
+
+    >>> session = SortSession(image, mask_image=mask, seed=0)
+    >>> session.update(lower_threshold=0.3)
+    >>> mask.paste(255, (100, 40, 180, 60))
+    >>> session.update(mask_image=mask, box=(100, 40, 180, 60))
+    >>> session.image()
+    """
+
+    def __init__(
+        self,
+        image: typing.Union[Image.Image, np.ndarray],
+        mask_image: typing.Union[np.ndarray, Image.Image, None] = None,
+        interval_image: typing.Union[np.ndarray, Image.Image, None] = None,
+        angle: float = DEFAULTS["angle"],
+        super_pixel_size: int = DEFAULTS["super_pixel_size"],
+        seed: typing.Optional[int] = None,
+        workers: int = 1,
+        **parameters,
+    ):
+        """
+        :param image: image to pixelsort, or an (height, width, 3|4) uint8 array
+        :param mask_image: Image used for masking parts of the image, the same size as the image.
+        :param interval_image: Image used to define intervals. Must be black and white.
+        :param angle: Angle at which you're pixel sorting in degrees.
+        :param super_pixel_size: Size of super pixels to sort. Defaults to 1 (single pixel).
+        :param seed: Seed for random intervals and randomness. Unseeded sessions keep their draws until the interval
+            parameters change.
+        :param workers: Number of threads sorting bands of rows at the same time.
+        :param parameters: the other pixelsort keyword arguments, see SESSION_PARAMETERS
+        """
+        self._check(parameters)
+        self.parameters = {
+            name: parameters.get(name, DEFAULTS[name]) for name in SESSION_PARAMETERS
+        }
+        self.seed = seed
+        self.workers = workers
+        # Read by every update, so kept contiguous
+        self.original = np.ascontiguousarray(rgba_pixels(image))
+        height, width = self.original.shape[:2]
+        self.size = (width, height)
+        #: (height, width, 4) uint8 array of the current result, updated in place.
+        self.result = np.empty((height, width, 4), dtype=np.uint8)
+        #: Number of grid rows the last update sorted again.
+        self.sorted_rows = 0
+
+        self._setup = self._sort_setup(interval_image, angle, super_pixel_size)
+        self._super_pixel_image = self._setup.prepare(self.original)
+        self._row_view = block_rows(self._super_pixel_image)
+        cols, rows = self._super_pixel_image.size
+        self._mask = None
+        self.mask_data = np.zeros((rows, cols), dtype=bool)
+        self._set_mask(mask_image, np.ones(rows, dtype=bool))
+        self.perm = np.tile(np.arange(cols, dtype=np.min_scalar_type(cols)), (rows, 1))
+        self._intervals: typing.Optional[IntervalSet] = None
+        self._draw_state = None
+        self._segments = None
+        self._update_intervals()
+        self._update_segments()
+        self._sort(np.ones(rows, dtype=bool))
+
+    def image(self) -> Image.Image:
+        """The current result as an image."""
+        return Image.fromarray(self.result, "RGBA")
+
+    def update(
+        self,
+        mask_image: typing.Union[np.ndarray, Image.Image, None] = _UNCHANGED,
+        interval_image: typing.Union[np.ndarray, Image.Image, None] = _UNCHANGED,
+        box: typing.Optional[typing.Tuple[int, int, int, int]] = None,
+        **parameters,
+    ) -> np.ndarray:
+        """
+        Changes some inputs and sorts the rows they affect again.
+        :param mask_image: new mask, None for no mask
+        :param interval_image: new interval image, None for none
+        :param box: (left, top, right, bottom) pixel box outside of which the new mask is the same as the old one
+        :param parameters: new values of pixelsort keyword arguments, see SESSION_PARAMETERS
+        :return: the result array, updated in place
+        """
+        self._check(parameters)
+        rows = self._super_pixel_image.size[1]
+        dirty = np.zeros(rows, dtype=bool)
+        previous, self.parameters = self.parameters, {**self.parameters, **parameters}
+        if mask_image is not _UNCHANGED:
+            candidates = (
+                self._box_rows(box) if box is not None else np.ones(rows, dtype=bool)
+            )
+            dirty |= self._set_mask(mask_image, candidates)
+        if interval_image is not _UNCHANGED:
+            self._setup = self._sort_setup(
+                interval_image, self._setup.angle, self._setup.super_pixel_size
+            )
+        intervals_changed = interval_image is not _UNCHANGED or any(
+            self.parameters[name] != previous[name] for name in INTERVAL_PARAMETERS
+        )
+        if intervals_changed:
+            dirty |= self._update_intervals()
+        if self.parameters["sorting_function"] != previous["sorting_function"]:
+            dirty[:] = True
+        # Without randomness nothing is drawn, and segments only follow the intervals
+        if intervals_changed or self.parameters["randomness"] or previous["randomness"]:
+            dirty |= self._update_segments()
+        self._sort(dirty)
+        return self.result
+
+    @staticmethod
+    def _check(parameters: dict):
+        unknown = set(parameters) - set(SESSION_PARAMETERS)
+        if unknown:
+            raise TypeError(f"cannot change {', '.join(sorted(unknown))} in a session")
+
+    def _sort_setup(
+        self,
+        interval_image: typing.Union[np.ndarray, Image.Image, None],
+        angle: float,
+        super_pixel_size: int,
+    ) -> SortSetup:
+        # The session keeps its own mask grid
+        return SortSetup(
+            self.size,
+            interval_image=interval_image,
+            angle=angle,
+            super_pixel_size=super_pixel_size,
+            seed=self.seed,
+            workers=self.workers,
+        )
+
+    def _box_rows(self, box: typing.Tuple[int, int, int, int]) -> np.ndarray:
+        """Grid rows holding pixels of box."""
+        left, top, right, bottom = box
+        width, height = self.size
+        setup = self._setup
+        block = self._super_pixel_image.super_pixel_size
+        rows = np.zeros(self._super_pixel_image.size[1], dtype=bool)
+        if setup.line_map is None:
+            # Rows of the image rotated counterclockwise by quarter turns
+            start, stop = [
+                (top, bottom),
+                (width - right, width - left),
+                (height - bottom, height - top),
+                (left, right),
+            ][setup.quarter_turns]
+            rows[max(start, 0) // block : -(-stop // block)] = True
+        else:
+            slots = setup.line_map.inverse.reshape(height, width)[
+                top:bottom, left:right
+            ]
+            rows[slots // setup.line_map.grid_size[0] // block] = True
+        return rows
+
+    def _set_mask(
+        self,
+        mask_image: typing.Union[np.ndarray, Image.Image, None],
+        candidates: np.ndarray,
+    ) -> np.ndarray:
+        """Takes a new mask, recomputing the mask grid's candidate rows, and returns the rows that changed."""
+        if mask_image is None:
+            self._mask = None
+        elif (
+            isinstance(mask_image, np.ndarray)
+            and mask_image.ndim == 2
+            and mask_image.dtype == np.uint8
+        ):
+            # Already what converting would give, so strokes need no copy
+            self._mask = mask_image
+        else:
+            if isinstance(mask_image, np.ndarray):
+                mask_image = Image.fromarray(mask_image)
+            self._mask = np.asarray(mask_image.convert("L"))
+        if self._mask is not None and self._mask.shape != self.size[::-1]:
+            raise ValueError(
+                f"expected a mask of size {self.size}, got {self._mask.shape[::-1]}"
+            )
+        changed = np.zeros_like(candidates)
+        for start, stop in _runs(candidates):
+            rows = self._mask_rows(start, stop)
+            changed[start:stop] = (rows != self.mask_data[start:stop]).any(axis=1)
+            self.mask_data[start:stop] = rows
+        return changed
+
+    def _mask_rows(self, start: int, stop: int) -> np.ndarray:
+        """Rows start to stop of the mask grid, the same as SortSetup's: a block is sortable if any of its pixels are
+        masked for sorting."""
+        setup = self._setup
+        block = self._super_pixel_image.super_pixel_size
+        cols = self._super_pixel_image.size[0]
+        top, bottom = start * block, stop * block
+        if setup.line_map is None:
+            if self._mask is None:
+                return np.ones((stop - start, cols), dtype=bool)
+            strip = np.rot90(self._mask, setup.quarter_turns)[top:bottom]
+        else:
+            index = setup.line_map.index[top:bottom]
+            valid = index >= 0
+            if self._mask is None:
+                strip = np.where(valid, 255, 0).astype(np.uint8)
+            else:
+                strip = np.where(valid, self._mask.reshape(-1)[index], 0).astype(
+                    np.uint8
+                )
+        if block > 1:
+            strip = np.asarray(
+                Image.fromarray(np.ascontiguousarray(strip)).reduce(block)
+            )
+        rows = np.zeros((stop - start, cols), dtype=bool)
+        source = strip[:, :cols] > 0
+        rows[: source.shape[0], : source.shape[1]] = source
+        return rows
+
+    def _update_intervals(self) -> np.ndarray:
+        """Determines the intervals for the current parameters and returns the rows whose boundaries changed."""
+        setup = self._setup.with_intervals(
+            **{name: self.parameters[name] for name in INTERVAL_PARAMETERS}
+        )
+        rng = np.random.default_rng(self.seed)
+        intervals = IntervalSet.from_rows(setup.intervals(self._super_pixel_image, rng))
+        # Unsorted segments are drawn after the intervals, like in sort_image
+        self._draw_state = rng.bit_generator.state
+        previous, self._intervals = self._intervals, intervals
+        if previous is None:
+            return np.ones(len(intervals), dtype=bool)
+        return changed_rows(
+            intervals.boundaries,
+            intervals.offsets,
+            previous.boundaries,
+            previous.offsets,
+        )
+
+    def _update_segments(self) -> np.ndarray:
+        """Draws the segments randomness leaves unsorted again and returns the rows whose draws changed. Rows after a
+        row that gains or loses masked pixels or intervals get other draws."""
+        rng = np.random.default_rng()
+        rng.bit_generator.state = self._draw_state
+        segments = unsorted_segments(
+            self._intervals,
+            np.count_nonzero(self.mask_data, axis=1),
+            self.parameters["randomness"],
+            rng,
+        )
+        previous, self._segments = self._segments, segments
+        if previous is None:
+            return np.ones(len(self._intervals), dtype=bool)
+        segment_offsets, keep_unsorted = segments
+        return changed_rows(keep_unsorted, segment_offsets, previous[1], previous[0])
+
+    def _sort(self, dirty: np.ndarray):
+        """Sorts the dirty rows of the grid again and writes their pixels to the result."""
+        self.sorted_rows = int(np.count_nonzero(dirty))
+        logging.debug(f"Sorting {self.sorted_rows} rows again...")
+        keys = self._super_pixel_image.keys(
+            sorting_choices[self.parameters["sorting_function"]]
+        )
+        cols = self.perm.shape[1]
+        segment_offsets, keep_unsorted = self._segments
+
+        def sort_band(start: int, stop: int):
+            self.perm[start:stop] = np.arange(cols)
+            sort_rows(
+                self.perm,
+                keys,
+                self.mask_data,
+                self._intervals,
+                segment_offsets,
+                keep_unsorted,
+                start,
+                stop,
+            )
+            self._place(start, stop)
+
+        for start, stop in _runs(dirty):
+            map_row_bands(
+                lambda a, b: sort_band(start + a, start + b),
+                stop - start,
+                self.workers,
+            )
+
+    def _place(self, start: int, stop: int):
+        """Places rows start to stop of the grid and composites them onto the original in the result."""
+        super_pixel_image = self._super_pixel_image
+        block = super_pixel_image.super_pixel_size
+        pixels = gather_rows(
+            self._row_view,
+            self.perm,
+            block,
+            start,
+            stop,
+            super_pixel_image.original_size,
+        )
+        index = self._source_index(start * block, start * block + pixels.shape[0])
+        if self._setup.line_map is not None:
+            valid = index >= 0
+            index, pixels = index[valid], pixels[valid]
+        index, pixels = index.reshape(-1), pixels.reshape(-1, 4)
+        if pixels[:, 3].min() < 255:
+            # Squash the sorted pixels onto the original to ensure no
+            # unexpected transparencies; opaque ones would cover it exactly.
+            composite = Image.fromarray(
+                self.original.reshape(-1, 4)[index][None], "RGBA"
+            )
+            composite.alpha_composite(Image.fromarray(pixels[None], "RGBA"))
+            pixels = np.asarray(composite)[0]
+        self.result.reshape(-1, 4)[index] = pixels
+
+    def _source_index(self, top: int, bottom: int) -> np.ndarray:
+        """Flat index into the image of every pixel of rows top to bottom of the rotated image, -1 outside of it."""
+        setup = self._setup
+        if setup.line_map is not None:
+            return setup.line_map.index[top:bottom]
+        width, height = self.size
+        # Broadcast views, so only the requested rows are computed
+        y = np.broadcast_to(np.arange(height)[:, None], (height, width))
+        x = np.broadcast_to(np.arange(width), (height, width))
+        turns = setup.quarter_turns
+        return np.rot90(y, turns)[top:bottom] * width + np.rot90(x, turns)[top:bottom]
+
+
+def _runs(rows: np.ndarray) -> typing.List[typing.Tuple[int, int]]:
+    """(start, stop) of every run of True values."""
+    edges = np.flatnonzero(np.diff(np.concatenate(([0], rows.view(np.int8), [0]))))
+    return list(zip(edges[::2].tolist(), edges[1::2].tolist()))
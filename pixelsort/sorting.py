@@ -1,8 +1,10 @@
-import random
 import typing
 
 import numpy as np
 
+from pixelsort.constants import SORTING_FUNCTIONS
+from pixelsort.interval_set import IntervalSet
+from pixelsort.parallel import map_row_bands
 from pixelsort.super_pixel_image import SuperPixelImage
 
 
@@ -10,106 +12,236 @@ def sort_image(
     size: typing.Tuple[int, int],
     super_pixel_image: SuperPixelImage,
     mask_data: np.ndarray,
-    intervals: typing.List,
+    intervals: typing.Union[IntervalSet, typing.List[typing.List[int]]],
     randomness: float,
     sorting_function: typing.Callable[[np.ndarray], np.ndarray],
+    rng: typing.Optional[np.random.Generator] = None,
+    workers: int = 1,
+    band_height: typing.Optional[int] = None,
 ) -> np.ndarray:
-    """Sorts the super pixel grid row by row within the given intervals.
+    """Sorts the super pixel grid within the given intervals.
+
+    Every super pixel is labelled with a global segment id, one per
+    (row, interval) pair, and the whole grid is ordered by one stable
+    segmented sort on (segment, key) instead of a Python loop over rows.
+
+    Intervals left unsorted because of randomness are drawn from rng, an
+    unseeded generator by default. Bands of rows are sorted on workers
+    threads, at most band_height rows at a time if given; the result does
+    not depend on either.
 
     Returns perm, where perm[y, x] is the source column of the super pixel to
     place at grid position (x, y). Unmasked positions keep their own column.
     """
     width, height = size
-    keys = sorting_function(super_pixel_image.average_colors)
-    perm = np.tile(np.arange(width), (height, 1))
-
-    for y in range(height):
-        masked = np.nonzero(mask_data[y])[0]
-        if masked.size == 0:
-            continue
-        bounds = np.asarray(intervals[y], dtype=np.intp)
-        interval_ids = np.searchsorted(bounds, masked, side="right")
-        keep_unsorted = np.array(
-            [random.random() * 100 < randomness for _ in range(len(bounds) + 1)]
+    keys = super_pixel_image.keys(sorting_function)
+    # The smallest type holding every column, as perm lives as long as the
+    # sorted image is being placed.
+    perm = np.tile(np.arange(width, dtype=np.min_scalar_type(width)), (height, 1))
+
+    mask_data = mask_data[:height, :width]
+    masked_counts = np.count_nonzero(mask_data, axis=1)
+    if not masked_counts.any():
+        return perm
+
+    intervals = IntervalSet.from_rows(intervals)
+    segment_offsets, keep_unsorted = unsorted_segments(
+        intervals, masked_counts, randomness, rng
+    )
+
+    def sort_band(start: int, stop: int):
+        sort_rows(
+            perm,
+            keys,
+            mask_data,
+            intervals,
+            segment_offsets,
+            keep_unsorted,
+            start,
+            stop,
         )
-        # Unsorted intervals use the column itself as key, preserving order;
-        # lexsort is stable and groups by interval before comparing keys.
-        row_keys = np.where(keep_unsorted[interval_ids], masked, keys[y, masked])
-        order = np.lexsort((row_keys, interval_ids))
-        perm[y, masked] = masked[order]
+
+    map_row_bands(sort_band, height, workers, band_height)
     return perm
 
 
-# Sort functions. Each takes the (height, width, 4) array of average colors
-# and returns a (height, width) array of sort keys.
+def unsorted_segments(
+    intervals: IntervalSet,
+    masked_counts: np.ndarray,
+    randomness: float,
+    rng: typing.Optional[np.random.Generator] = None,
+) -> typing.Tuple[np.ndarray, np.ndarray]:
+    """The segments, one per (row, interval) pair, that randomness leaves
+    unsorted.
+
+    One draw is made per segment of every row containing masked pixels, in
+    row order, up front, so bands see the same draws however they are split.
+
+    Returns segment_offsets, where row y owns the segments
+    segment_offsets[y] .. segment_offsets[y + 1] - 1, and keep_unsorted,
+    True for every segment left unsorted.
+    """
+    counts = intervals.counts
+    segment_offsets = np.concatenate(([0], np.cumsum(counts + 1)))
+    keep_unsorted = np.zeros(segment_offsets[-1], dtype=bool)
+    if randomness > 0:
+        rng = rng if rng is not None else np.random.default_rng()
+        segment_rows = np.repeat(np.arange(len(intervals)), counts + 1)
+        draws = np.nonzero(masked_counts[segment_rows])[0]
+        keep_unsorted[draws] = rng.random(draws.size) * 100 < randomness
+    return segment_offsets, keep_unsorted
+
+
+def sort_rows(
+    perm: np.ndarray,
+    keys: np.ndarray,
+    mask_data: np.ndarray,
+    intervals: IntervalSet,
+    segment_offsets: np.ndarray,
+    keep_unsorted: np.ndarray,
+    start: int,
+    stop: int,
+):
+    """Sorts rows start to stop of the grid into the same rows of perm, which
+    must hold every position's own column where the mask is not set."""
+    _sort_rows(
+        perm[start:stop],
+        keys[start:stop],
+        mask_data[start:stop],
+        intervals.band(start, stop),
+        keep_unsorted[segment_offsets[start] : segment_offsets[stop]],
+    )
+
+
+def _sort_rows(
+    perm: np.ndarray,
+    keys: np.ndarray,
+    mask_data: np.ndarray,
+    intervals: IntervalSet,
+    keep_unsorted: np.ndarray,
+):
+    """Sorts a band of rows of sort_image into its band of perm, given the
+    band's own intervals and unsorted segments."""
+    height, width = perm.shape
+    masked_counts = np.count_nonzero(mask_data, axis=1)
+    rows = np.nonzero(masked_counts)[0]
+    if rows.size == 0:
+        return
+    interval_ids = _interval_ids(intervals, (width, height))
+    counts = intervals.counts
+    if rows.size < height:
+        keys, interval_ids = keys[rows], interval_ids[rows]
+
+    # Unsorted intervals get one key for all their pixels, so the stable sort
+    # keeps them in column order.
+    # Unmasked pixels get an interval id past every real one, so each row
+    # starts with its masked pixels grouped by interval and ordered by key.
+    if keep_unsorted.any():
+        first_segment = np.concatenate(([0], np.cumsum(counts + 1)[:-1]))
+        segments = first_segment[rows, None] + interval_ids
+        keys = np.where(keep_unsorted[segments], 0, keys)
+    past_last = counts.max() + 1
+    if masked_counts[rows].min() < width:
+        interval_ids = np.where(mask_data[rows], interval_ids, past_last)
+    interval_ids = interval_ids.astype(np.min_scalar_type(past_last))
+
+    # A stable sort by key followed by a stable sort by interval id is a
+    # lexsort; doing it along axis 1 keeps every row's sort cache-local.
+    by_key = np.argsort(keys, axis=1, kind="stable")
+    by_interval = np.argsort(
+        np.take_along_axis(interval_ids, by_key, axis=1), axis=1, kind="stable"
+    )
+    order = np.take_along_axis(by_key, by_interval, axis=1)
+
+    if rows.size == height and masked_counts.min() == width:
+        perm[...] = order
+        return
+    sorted_part = np.arange(width) < masked_counts[rows, None]
+    perm[mask_data] = order[sorted_part]
+
+
+def _interval_ids(intervals: IntervalSet, size: typing.Tuple[int, int]) -> np.ndarray:
+    """Labels each grid position with the index of its interval within its row,
+    i.e. the number of row boundaries at or left of it."""
+    width, height = size
+    marks = np.bincount(
+        intervals.rows * (width + 1) + np.clip(intervals.boundaries, 0, width),
+        minlength=height * (width + 1),
+    ).reshape(height, width + 1)
+    return np.cumsum(marks[:, :width], axis=1)
+
+
+# Sort functions. Each takes the (height, width, 4) uint8 array of average
+# colors and returns a (height, width) array of integer sort keys, ordered
+# exactly like the HLS value they are named after. Keys of 16 bits or less are
+# sorted by NumPy's stable sort as a radix sort, in linear time.
 
 
 def _channels(average_colors: np.ndarray):
-    rgb = average_colors.astype(np.float64)
-    return rgb[..., 0], rgb[..., 1], rgb[..., 2]
+    return average_colors[..., 0], average_colors[..., 1], average_colors[..., 2]
 
 
-def pixel_lightness(pixel: typing.Tuple[int, int, int]) -> float:
-    """Lightness of a raw pixel tuple according to a HLS representation."""
-    # taken from rgb_to_hls
-    r, g, b = pixel[:3]
-    maxc = max(r, g, b)
-    minc = min(r, g, b)
-    return (minc + maxc) / 2.0
+def _extremes(average_colors: np.ndarray) -> typing.Tuple[np.ndarray, np.ndarray]:
+    r, g, b = _channels(average_colors)
+    return np.maximum(np.maximum(r, g), b), np.minimum(np.minimum(r, g), b)
 
 
 def lightness(average_colors: np.ndarray) -> np.ndarray:
-    """Sort by the lightness of a pixel according to a HLS representation."""
+    """Sort by the lightness of a pixel according to a HLS representation. Keys are twice the lightness, 0 to
+    510."""
     # taken from rgb_to_hls
-    r, g, b = _channels(average_colors)
-    maxc = np.maximum(np.maximum(r, g), b)
-    minc = np.minimum(np.minimum(r, g), b)
-    return (minc + maxc) / 2.0
+    maxc, minc = _extremes(average_colors)
+    return maxc.astype(np.uint16) + minc
+
+
+# Scale of hue keys: hues of 8-bit colors are fractions with denominators up
+# to 255 within each sixth of the circle, so any two distinct ones are at least
+# 1 / (255 * 254) apart there and stay apart after flooring.
+_HUE_STEPS = 2 * 255 * 254
 
 
 def hue(average_colors: np.ndarray) -> np.ndarray:
-    """Sort by the hue of a pixel according to a HLS representation."""
-    # taken from rgb_to_hls
-    r, g, b = _channels(average_colors)
-    maxc = np.maximum(np.maximum(r, g), b)
-    minc = np.minimum(np.minimum(r, g), b)
-    diffc = maxc - minc
-    safe_diffc = np.where(diffc == 0, 1.0, diffc)
-    rc = (maxc - r) / safe_diffc
-    gc = (maxc - g) / safe_diffc
-    bc = (maxc - b) / safe_diffc
-    h = np.where(r == maxc, bc - gc, np.where(g == maxc, 2.0 + rc - bc, 4.0 + gc - rc))
-    h = (h / 6.0) % 1.0
-    return np.where(diffc == 0, 0.0, h)
+    """Sort by the hue of a pixel according to a HLS representation. Keys are the hue scaled to 0 to
+    6 * _HUE_STEPS."""
+    # taken from rgb_to_hls, in exact integer arithmetic
+    r, g, b = (channel.astype(np.int32) for channel in _channels(average_colors))
+    maxc, minc = _extremes(average_colors)
+    diffc = maxc.astype(np.int32) - minc
+    # Position within the circle in units of diffc, 0 to 6 * diffc
+    h = np.where(
+        r == maxc, g - b, np.where(g == maxc, 2 * diffc + b - r, 4 * diffc + r - g)
+    )
+    h += np.where(h < 0, 6 * diffc, 0)
+    h *= _HUE_STEPS
+    h //= np.where(diffc == 0, 1, diffc)
+    return h.astype(np.uint32)
+
+
+# With 0-255 channels rgb_to_hls' saturation only depends on diffc = max - min:
+# it is diffc / (2 - diffc), which is 0 for diffc 0 and 2, 1 for diffc 1 and
+# rises from -3 towards -1 for diffc 3 to 255. Ranked in that order:
+_SATURATION_RANKS = np.concatenate(([256, 257, 256], np.arange(3, 256))).astype(
+    np.uint16
+)
 
 
 def saturation(average_colors: np.ndarray) -> np.ndarray:
-    """Sort by the saturation of a pixel according to a HLS representation."""
+    """Sort by the saturation of a pixel according to a HLS representation. Keys rank the saturation from 3 to
+    257."""
     # taken from rgb_to_hls
-    r, g, b = _channels(average_colors)
-    maxc = np.maximum(np.maximum(r, g), b)
-    minc = np.minimum(np.minimum(r, g), b)
-    sumc = minc + maxc
-    diffc = maxc - minc
-    sdiv = 2.0 - diffc
-    s = np.where(
-        sumc / 2.0 <= 0.5,
-        diffc / np.where(sumc == 0, 1.0, sumc),
-        diffc / np.where(sdiv == 0, 1.0, sdiv),
-    )
-    return np.where((diffc == 0) | (sumc == 0) | (sdiv == 0), 0.0, s)
+    maxc, minc = _extremes(average_colors)
+    return _SATURATION_RANKS[maxc - minc]
 
 
 def intensity(average_colors: np.ndarray) -> np.ndarray:
     """Sort by the intensity of a pixel, i.e. the sum of all the RGB values."""
     r, g, b = _channels(average_colors)
-    return r + g + b
+    return r.astype(np.uint16) + g + b
 
 
 def minimum(average_colors: np.ndarray) -> np.ndarray:
     """Sort on the minimum RGB value of a pixel (either the R, G or B)."""
-    r, g, b = _channels(average_colors)
-    return np.minimum(np.minimum(r, g), b)
+    return _extremes(average_colors)[1]
 
 
 sorting_choices = {
@@ -119,3 +251,5 @@ sorting_choices = {
     "minimum": minimum,
     "saturation": saturation,
 }
+# The CLI offers the names in constants, so it can do without importing this
+assert tuple(sorting_choices) == SORTING_FUNCTIONS, "update SORTING_FUNCTIONS"
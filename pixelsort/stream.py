@@ -0,0 +1,160 @@
+import logging
+import queue
+import threading
+import typing
+
+import numpy as np
+
+from pixelsort.constants import DEFAULTS
+from pixelsort.main import SortSetup, sort_array
+
+# Raw pixel formats of pixelsort_stream, named like ffmpeg's, and their
+# number of channels.
+PIXEL_FORMATS = {"rgb24": 3, "rgba": 4}
+
+
+def pixelsort_stream(
+    source: typing.BinaryIO,
+    sink: typing.BinaryIO,
+    size: typing.Tuple[int, int],
+    pixel_format: str = "rgb24",
+    randomness: float = DEFAULTS["randomness"],
+    sorting_function: str = DEFAULTS["sorting_function"],
+    queue_size: int = 4,
+    **options,
+) -> int:
+    """
+    pixelsorts raw video frames, e.g. piped from ffmpeg with -f rawvideo, until source ends. Frames are read, sorted
+    and written on three threads, with at most queue_size frames waiting between them, into a fixed set of buffers
+    that are reused for every frame. The mask grid, interval image and file based intervals are prepared once for the
+    whole stream.
+    :param source: binary stream of frames of width * height pixels of pixel_format each, back to back
+    :param sink: binary stream the sorted frames are written to, in the same format
+    :param size: (width, height) of the frames
+    :param pixel_format: rgb24 or rgba, see PIXEL_FORMATS
+    :param randomness: What percentage of intervals *not* to sort. 0 by default.
+    :param sorting_function: Sorting function to use for sorting the pixels.
+    :param queue_size: number of frames that may wait to be sorted, and to be written
+    :param options: remaining keyword arguments for pixelsort, see SortSetup. With a seed, every frame gets the same
+        random intervals.
+    :return: number of frames sorted
+    """
+    if pixel_format not in PIXEL_FORMATS:
+        raise ValueError(f"pixel_format must be one of {', '.join(PIXEL_FORMATS)}")
+    channels = PIXEL_FORMATS[pixel_format]
+    width, height = size
+    setup = SortSetup(size, **options)
+
+    # Frames and results go round between the threads through these, so
+    # nothing is allocated per frame. Each thread may hold one besides the
+    # queued ones.
+    free_frames, free_results = queue.Queue(), queue.Queue()
+    for _ in range(queue_size + 2):
+        frame = np.empty((height, width, 4), dtype=np.uint8)
+        # RGB frames are read next to an alpha channel that stays opaque
+        frame[..., 3] = 255
+        free_frames.put(frame)
+        free_results.put(np.empty((height, width, 4), dtype=np.uint8))
+    frames, results = queue.Queue(queue_size), queue.Queue(queue_size)
+    # Set when sorting or writing fails, so the other threads wind down
+    # instead of waiting
+    stop = threading.Event()
+    errors = []
+
+    def read():
+        raw = memoryview(bytearray(width * height * channels))
+        try:
+            while not stop.is_set():
+                frame = free_frames.get()
+                buffer = memoryview(frame).cast("B") if channels == 4 else raw
+                if not _read_frame(source, buffer):
+                    free_frames.put(frame)
+                    break
+                if channels == 3:
+                    frame[..., :3] = np.frombuffer(raw, np.uint8).reshape(
+                        height, width, 3
+                    )
+                frames.put(frame)
+        except Exception as e:
+            # Only ends the input: the frames read so far are still sorted
+            # and written before it is raised.
+            errors.append(e)
+        frames.put(None)
+
+    def write():
+        rgb = np.empty((height, width, 3), dtype=np.uint8) if channels == 3 else None
+        while True:
+            result = results.get()
+            if result is None:
+                break
+            if not stop.is_set():
+                try:
+                    if rgb is not None:
+                        np.copyto(rgb, result[..., :3])
+                    sink.write(memoryview(result if rgb is None else rgb).cast("B"))
+                except Exception as e:
+                    errors.append(e)
+                    stop.set()
+            free_results.put(result)
+        if not stop.is_set():
+            try:
+                sink.flush()
+            except Exception as e:
+                errors.append(e)
+
+    reader = threading.Thread(target=read, name="pixelsort-read")
+    writer = threading.Thread(target=write, name="pixelsort-write")
+    reader.start()
+    writer.start()
+    count = 0
+    try:
+        while True:
+            frame = frames.get()
+            if frame is None:
+                break
+            if stop.is_set():
+                free_frames.put(frame)
+                continue
+            result = free_results.get()
+            try:
+                sort_array(frame, setup, randomness, sorting_function, out=result)
+            except BaseException:
+                free_results.put(result)
+                raise
+            finally:
+                free_frames.put(frame)
+            results.put(result)
+            count += 1
+            logging.debug(f"Sorted frame {count}")
+    except BaseException:
+        stop.set()
+        # Hands the reader back its frames until it sees the stop
+        while True:
+            frame = frames.get()
+            if frame is None:
+                break
+            free_frames.put(frame)
+        raise
+    finally:
+        results.put(None)
+        reader.join()
+        writer.join()
+    if errors:
+        raise errors[0]
+    return count
+
+
+def _read_frame(source: typing.BinaryIO, buffer: memoryview) -> bool:
+    """Fills buffer from source. Returns False if source ended before the frame, and raises ValueError if it ended
+    in the middle of one."""
+    filled = 0
+    while filled < len(buffer):
+        read = source.readinto(buffer[filled:])
+        if not read:
+            if filled:
+                raise ValueError(
+                    f"stream ended {filled} bytes into a frame of {len(buffer)}"
+                )
+            return False
+        filled += read
+    return True
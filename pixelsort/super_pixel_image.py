@@ -1,14 +1,79 @@
+import copy
+import typing
+
 import numpy as np
 from PIL import Image
 
+from pixelsort.disk_cache import DiskCache, cached
+
 
 class SuperPixelImage:
-    def __init__(self, image: Image.Image, super_pixel_size: int):
+    def __init__(
+        self,
+        image: typing.Union[Image.Image, np.ndarray],
+        super_pixel_size: int,
+        cache: typing.Optional[DiskCache] = None,
+        cache_key: tuple = (),
+    ):
+        """
+        :param image: image to split into super pixels, or its (height, width, channels) uint8 array. Arrays may be
+            strided views, e.g. a transposed image; they are only copied when super pixels have to be averaged.
+        :param super_pixel_size: Size of super pixels. 1 uses the pixels themselves.
+        :param cache: DiskCache to keep the average colors and keys in across runs
+        :param cache_key: values identifying image in the cache, e.g. its digest and rotation
+        """
         self.super_pixel_size = super_pixel_size
-        self.source_image = image
-        self.original_size = image.size
-        self.scaled_image = (
-            image.reduce(super_pixel_size) if super_pixel_size > 1 else image
-        )
-        self.size = self.scaled_image.size
-        self.average_colors = np.asarray(self.scaled_image)
+        self.source = np.asarray(image)
+        self.original_size = (self.source.shape[1], self.source.shape[0])
+        self.cache = cache
+        self.cache_key = cache_key + (super_pixel_size,)
+        if super_pixel_size > 1:
+            self.average_colors = cached(
+                cache, self._reduce, "average_colors", *self.cache_key
+            )
+        else:
+            self.average_colors = self.source
+        self.size = (self.average_colors.shape[1], self.average_colors.shape[0])
+        self._keys = {}
+
+    def _reduce(self) -> np.ndarray:
+        scaled_image = Image.fromarray(np.ascontiguousarray(self.source))
+        return np.asarray(scaled_image.reduce(self.super_pixel_size))
+
+    def keys(self, function: typing.Callable[[np.ndarray], np.ndarray]) -> np.ndarray:
+        """Values of function over the average colors, e.g. sort keys or lightness levels. Computed once per function
+        and kept for as long as the image, so threshold intervals and lightness sorting share one array. With a cache
+        they are also kept on disk.
+        """
+        if function not in self._keys:
+            name = f"{function.__module__}.{function.__qualname__}"
+            # Only named module level functions can be told apart across runs
+            cache = self.cache if "<" not in name else None
+            self._keys[function] = cached(
+                cache,
+                lambda: function(self.average_colors),
+                "keys",
+                name,
+                *self.cache_key,
+            )
+        return self._keys[function]
+
+    def crop(self, box: typing.Tuple[int, int, int, int]) -> "SuperPixelImage":
+        """The super pixels in box, (left, top, right, bottom) on the grid, as an image of their own sharing this one's
+        arrays and the keys computed so far. Keys computed on the crop are not cached on disk, as they are not the
+        image's."""
+        left, top, right, bottom = box
+        block = self.super_pixel_size
+        cropped = copy.copy(self)
+        cropped.source = self.source[
+            top * block : bottom * block, left * block : right * block
+        ]
+        cropped.original_size = (cropped.source.shape[1], cropped.source.shape[0])
+        cropped.cache = None
+        cropped.average_colors = self.average_colors[top:bottom, left:right]
+        cropped.size = (right - left, bottom - top)
+        cropped._keys = {
+            function: keys[top:bottom, left:right]
+            for function, keys in self._keys.items()
+        }
+        return cropped
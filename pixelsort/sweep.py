@@ -0,0 +1,144 @@
+import itertools
+import logging
+import math
+import os
+import typing
+
+from PIL import Image
+
+from pixelsort.constants import (
+    DEFAULTS,
+    GEOMETRY_PARAMETERS,
+    INTERVAL_PARAMETERS,
+    SORTING_PARAMETERS,
+)
+from pixelsort.disk_cache import DiskCache
+from pixelsort.main import SortSetup, sort_frame
+from pixelsort.util import save_image
+
+SWEEP_PARAMETERS = GEOMETRY_PARAMETERS + INTERVAL_PARAMETERS + SORTING_PARAMETERS
+
+
+def pixelsort_sweep(
+    image: Image.Image,
+    mask_image: typing.Optional[Image.Image] = None,
+    interval_image: typing.Optional[Image.Image] = None,
+    seed: typing.Optional[int] = None,
+    workers: int = 1,
+    cache: typing.Optional[DiskCache] = None,
+    memory_budget: typing.Optional[int] = None,
+    **parameters,
+) -> typing.Iterator[typing.Tuple[dict, Image.Image]]:
+    """
+    pixelsorts an image for every combination of the given parameter values. The rotated SuperPixelImage is built
+    once per angle and super pixel size, and each sort key and lightness level is computed once per
+    SuperPixelImage, so only the interval, sort and placement stages run for every combination.
+    :param image: image to pixelsort
+    :param mask_image: Image used for masking parts of the image.
+    :param interval_image: Image used to define intervals. Must be black and white.
+    :param seed: Seed for random intervals and randomness. Each result is the same as pixelsort() with this seed.
+    :param workers: Number of threads sorting bands of rows of each image.
+    :param cache: DiskCache keeping the rotated image, super pixels, sort keys and static intervals across runs.
+    :param memory_budget: Approximate number of bytes for the temporary arrays of sorting and placing pixels.
+    :param parameters: pixelsort keyword arguments (see SWEEP_PARAMETERS), each a single value or a list of values
+    :return: iterator of (parameters, pixelsorted image) pairs, grouped by angle and super pixel size
+    """
+    unknown = set(parameters) - set(SWEEP_PARAMETERS)
+    if unknown:
+        raise TypeError(f"cannot sweep over {', '.join(sorted(unknown))}")
+    values = {
+        name: _as_list(parameters.get(name, DEFAULTS[name]))
+        for name in SWEEP_PARAMETERS
+    }
+
+    for geometry in _combinations(values, GEOMETRY_PARAMETERS):
+        logging.debug(f"Sweeping {geometry}...")
+        setup = SortSetup(
+            image.size,
+            mask_image=mask_image,
+            interval_image=interval_image,
+            seed=seed,
+            workers=workers,
+            cache=cache,
+            memory_budget=memory_budget,
+            **geometry,
+        )
+        super_pixel_image = setup.prepare(image)
+        for interval_options in _combinations(values, INTERVAL_PARAMETERS):
+            interval_setup = setup.with_intervals(**interval_options)
+            for sorting in _combinations(values, SORTING_PARAMETERS):
+                yield {**geometry, **interval_options, **sorting}, sort_frame(
+                    image,
+                    interval_setup,
+                    super_pixel_image=super_pixel_image,
+                    **sorting,
+                )
+
+
+def save_sweep(
+    results: typing.Iterable[typing.Tuple[dict, Image.Image]],
+    output_dir: str,
+    stem: str,
+    varying: typing.Sequence[str] = SWEEP_PARAMETERS,
+    extension: str = ".png",
+    thumbnail_width: int = 256,
+) -> typing.List[str]:
+    """
+    Saves sweep results into output_dir as they are produced and writes a contact sheet of all of them to
+    contact_sheet.png.
+    :param results: (parameters, image) pairs as returned by pixelsort_sweep
+    :param output_dir: directory to write to, created if needed
+    :param stem: file name prefix
+    :param varying: parameters to name the files after, see varying_parameters
+    :param extension: image file extension
+    :param thumbnail_width: width of each image on the contact sheet
+    :return: paths of the saved images, in order
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    paths = []
+    thumbnails = []
+    for parameters, image in results:
+        label = "".join(f"_{name}-{parameters[name]}" for name in varying)
+        path = os.path.join(output_dir, f"{stem}{label}{extension}")
+        save_image(image, path)
+        paths.append(path)
+        logging.info(f"Saved {path}")
+        thumbnail_height = max(image.height * thumbnail_width // image.width, 1)
+        thumbnails.append(image.resize((thumbnail_width, thumbnail_height)))
+    if thumbnails:
+        save_image(
+            contact_sheet(thumbnails), os.path.join(output_dir, "contact_sheet.png")
+        )
+    return paths
+
+
+def varying_parameters(parameters: dict) -> typing.List[str]:
+    """Names of the parameters given more than one value, in sweep order."""
+    return [
+        name
+        for name in SWEEP_PARAMETERS
+        if len(_as_list(parameters.get(name, DEFAULTS[name]))) > 1
+    ]
+
+
+def contact_sheet(
+    images: typing.Sequence[Image.Image], columns: typing.Optional[int] = None
+) -> Image.Image:
+    """Lays images out on a grid, row by row, in cells the size of the largest image."""
+    columns = columns or math.ceil(math.sqrt(len(images)))
+    rows = math.ceil(len(images) / columns)
+    cell_width = max(image.width for image in images)
+    cell_height = max(image.height for image in images)
+    sheet = Image.new("RGBA", (columns * cell_width, rows * cell_height))
+    for i, image in enumerate(images):
+        sheet.paste(image, ((i % columns) * cell_width, (i // columns) * cell_height))
+    return sheet
+
+
+def _as_list(value) -> list:
+    return list(value) if isinstance(value, (list, tuple, range)) else [value]
+
+
+def _combinations(values: dict, names: typing.Sequence[str]) -> typing.Iterator[dict]:
+    for combination in itertools.product(*(values[name] for name in names)):
+        yield dict(zip(names, combination))
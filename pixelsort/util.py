@@ -1,5 +1,9 @@
+import io
+import os
 import time
+import typing
 
+import numpy as np
 from PIL import Image
 
 
@@ -8,20 +12,75 @@ def id_generator() -> str:
     return timestr
 
 
-def crop_to(image_to_crop: Image.Image, reference_image: Image.Image) -> Image.Image:
+def open_output(path: str, image: typing.Union[Image.Image, np.ndarray]) -> np.ndarray:
+    """Creates a memory-mapped .npy file to receive the (height, width, 4) RGBA result of pixelsorting image."""
+    if isinstance(image, Image.Image):
+        shape = image.size[1], image.size[0]
+    else:
+        shape = image.shape[:2]
+    return np.lib.format.open_memmap(
+        path, mode="w+", dtype=np.uint8, shape=tuple(shape) + (4,)
+    )
+
+
+def format_name(name: str) -> str:
+    """
+    Pillow's name of an image format, given as a format name or file extension in any case, e.g. "jpg", ".JPG" and
+    "jpeg" all give "JPEG". Raises ValueError for unknown formats.
+    """
+    name = name.lower().lstrip(".")
+    image_format = Image.registered_extensions().get(f".{name}")
+    if image_format is None and name.upper() in Image.SAVE:
+        image_format = name.upper()
+    if image_format is None:
+        raise ValueError(f"unknown image format: {name}")
+    return image_format
+
+
+def write_image(
+    image: Image.Image, output: typing.Union[str, typing.BinaryIO], image_format: str
+) -> None:
+    """
+    Writes an image in a format, dropping the alpha channel for formats that cannot store it.
+    :param image: image to write
+    :param output: path or binary file to write to
+    :param image_format: format name or file extension, see format_name
+    """
+    image_format = format_name(image_format)
+    if image_format == "JPEG":
+        # JPEG has no alpha channel
+        image = image.convert("RGB")
+    image.save(output, format=image_format)
+
+
+def encode_image(image: Image.Image, image_format: str) -> bytes:
+    """An image encoded in a format, see write_image."""
+    output = io.BytesIO()
+    write_image(image, output, image_format)
+    return output.getvalue()
+
+
+def decode_image(data: bytes) -> Image.Image:
+    """An encoded image, decoded right away rather than on first use."""
+    image = Image.open(io.BytesIO(data))
+    image.load()
+    return image
+
+
+def save_image(image: Image.Image, path: str) -> None:
     """
-    Crops image to the size of a reference image. This function assumes that the relevant image is located in the center
-    and you want to crop away equal sizes on both the left and right as well on both the top and bottom.
-    :param image_to_crop
-    :param reference_image
-    :return: image cropped to the size of the reference image
+    Saves an image, dropping the alpha channel for formats that cannot store it. The image is written to a temporary
+    file next to path first and then moved into place, so an interrupted save never leaves a truncated file behind.
+    :param image: image to save
+    :param path: destination path; the format is chosen from its extension
     """
-    reference_size = reference_image.size
-    current_size = image_to_crop.size
-    dx = current_size[0] - reference_size[0]
-    dy = current_size[1] - reference_size[1]
-    left = dx / 2
-    upper = dy / 2
-    right = dx / 2 + reference_size[0]
-    lower = dy / 2 + reference_size[1]
-    return image_to_crop.crop(box=(int(left), int(upper), int(right), int(lower)))
+    extension = os.path.splitext(path)[1]
+    if extension.lower() not in Image.registered_extensions():
+        raise ValueError(f"unknown file extension: {path}")
+    temporary_path = f"{path}.partial"
+    try:
+        write_image(image, temporary_path, extension)
+        os.replace(temporary_path, path)
+    finally:
+        if os.path.exists(temporary_path):
+            os.remove(temporary_path)
@@ -0,0 +1,107 @@
+import base64
+import http.client
+import io
+import json
+import os
+import signal
+import threading
+import unittest
+
+import numpy as np
+from PIL import Image
+
+from pixelsort.server import SortServer
+
+
+def _png() -> bytes:
+    pixels = np.random.default_rng(0).integers(0, 256, (16, 24, 3), dtype=np.uint8)
+    output = io.BytesIO()
+    Image.fromarray(pixels).save(output, format="png")
+    return output.getvalue()
+
+
+class SortServerTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = SortServer(("127.0.0.1", 0), jobs=1, cache_size=0)
+        cls.thread = threading.Thread(target=cls.server.serve_forever, daemon=True)
+        cls.thread.start()
+        cls.image = _png()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def post(self, body: bytes, query: str = "", headers=None) -> int:
+        connection = http.client.HTTPConnection(*self.server.server_address)
+        try:
+            connection.request("POST", f"/sort?{query}", body, headers or {})
+            response = connection.getresponse()
+            response.read()
+            return response.status
+        finally:
+            connection.close()
+
+    def post_json(self, **fields) -> int:
+        fields["image"] = base64.b64encode(self.image).decode()
+        return self.post(
+            json.dumps(fields).encode(), headers={"Content-Type": "application/json"}
+        )
+
+    def test_sorts(self):
+        self.assertEqual(self.post(self.image, "angle=90&sorting_function=hue"), 200)
+        self.assertEqual(self.post_json(format="jpeg", super_pixel_size=2), 200)
+
+    def test_rejects_malformed_parameters(self):
+        for fields in (
+            {"sorting_function": ["hue"]},
+            {"interval_function": {"name": "edges"}},
+            {"sorting_function": "brightness"},
+            {"format": ["png"]},
+            {"format": "bmp"},
+            {"super_pixel_size": 0},
+            {"super_pixel_size": -2},
+            {"super_pixel_size": "two"},
+            {"angle": float("nan")},
+            {"char_length": float("inf")},
+            {"lower_threshold": [0.25]},
+            {"seed": float("inf")},
+            {"seed": -1},
+            {"colour": "red"},
+        ):
+            with self.subTest(fields=fields):
+                self.assertEqual(self.post_json(**fields), 400)
+        for query in ("angle=nan", "upper_threshold=inf", "super_pixel_size=0"):
+            with self.subTest(query=query):
+                self.assertEqual(self.post(self.image, query), 400)
+
+    def test_rejects_malformed_requests(self):
+        self.assertEqual(self.post(b""), 400)
+        headers = {"Content-Type": "application/json"}
+        self.assertEqual(self.post(b"[1, 2]", headers=headers), 400)
+        self.assertEqual(self.post(b"{", headers=headers), 400)
+
+    def test_rejects_malformed_content_length(self):
+        for length in ("-1", "abc"):
+            with self.subTest(length=length):
+                connection = http.client.HTTPConnection(*self.server.server_address)
+                try:
+                    connection.putrequest("POST", "/sort")
+                    connection.putheader("Content-Length", length)
+                    connection.endheaders()
+                    self.assertEqual(connection.getresponse().status, 400)
+                finally:
+                    connection.close()
+
+    @unittest.skipUnless(hasattr(signal, "SIGKILL"), "needs SIGKILL")
+    def test_recovers_from_a_dead_worker(self):
+        for pid in list(self.server.pool._processes):
+            os.kill(pid, signal.SIGKILL)
+        self.assertEqual(self.post(self.image), 503)
+        self.assertEqual(self.post(self.image), 200)
+        self.assertEqual(self.server.metrics()["pool_restarts"], 1)
+
+
+if __name__ == "__main__":
+    unittest.main()